@@ -1,48 +1,244 @@
-import os, requests
-from flask import Flask, render_template, request, flash, redirect, session, g
+import os, time, math, click, json, gzip, hashlib, hmac, base64, binascii
+from flask import Flask, Blueprint, current_app, render_template, request, flash, redirect, session, g, jsonify, make_response, abort
+from flask import before_render_template, template_rendered, has_request_context
 # from flask_debugtoolbar import DebugToolbarExtension
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy import text
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError, TimeoutError as PoolTimeoutError
+from sqlalchemy.orm import joinedload, selectinload, undefer
+from werkzeug.http import is_resource_modified
+from werkzeug.middleware.proxy_fix import ProxyFix
 from functools import wraps
 
-from forms import UserAddForm, LoginForm, TruckAddForm, UserEditForm, ChangePasswordForm, TruckEditForm, UserReviewForm, UserReviewEditForm, TruckLocationForm
-from models import db, connect_db, User, Truck, Review
-
-from secrets2 import API_SECRET_KEY, APP_SECRET_KEY, ACCESS_TOKEN
+# forms (WTForms) is imported inside the views that use it, to keep it off
+# the startup path; see tests/test_startup.py.
+from models import db, connect_db, bcrypt, User, Truck, Review, Favorite, TableVersion
+import geocoding
+import clustering
+import suggest
+import identity
+import fragments
+import passwords
+import throttle
+import migrate
+import dbpool
 
 CURR_USER_KEY = "curr_user"
-KEY = API_SECRET_KEY
 # GEOCODE_API_BASE_URL = "https://www.mapquestapi.com/geocoding/v1"
 GEOCODE_API_BASE_URL = "https://api.mapbox.com/geocoding/v5/mapbox"
+# Deepest zoom level the map requests (Mapbox GL stops at 24).
+MAX_MAP_ZOOM = 24
+# Reviews per page on a truck's review listing.
+REVIEWS_PER_PAGE = 20
+
+# Views, hooks and CLI commands; create_app() registers them on an app.
+# (cli_group=None keeps commands at the top level: `flask --app app migrate`.)
+bp = Blueprint("main", __name__, cli_group=None)
+
+
+def create_app(config=None):
+    """Build and configure the app; `config` overrides settings read from the environment.
+
+    Nothing here touches the database: tables are created by `flask --app
+    app init-db` and changed by `flask --app app migrate`, not at startup.
+    """
+
+    app = Flask(__name__)
+
+    # Get DB_URI from environ variable (useful for production/testing) or,
+    # if not set there, use development local db.
+    app.config['SQLALCHEMY_DATABASE_URI'] = (
+        os.environ.get('DATABASE_URL', 'postgresql:///food_truck'))
+
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ECHO'] = False
+    app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+    # Raise instead of lazy loading relationships while a template renders
+    # (N+1 guard; on by default in debug mode, see lazy_load_guard).
+    app.config['RAISE_ON_LAZY_LOAD'] = os.environ.get('RAISE_ON_LAZY_LOAD', '') == '1'
+    # Part of every page ETag: set RELEASE per deploy so template changes
+    # invalidate clients' copies (default: changes on every restart).
+    app.config['RELEASE'] = os.environ.get('RELEASE', str(int(time.time())))
+    # How long shared caches (CDN/proxy) may serve anonymous public pages.
+    app.config['PAGE_CACHE_MAX_AGE'] = int(os.environ.get('PAGE_CACHE_MAX_AGE', 30))
+    # bcrypt work factor; existing hashes are upgraded on the user's next login.
+    app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    # Proxies in front of the app (Render's load balancer is one) whose
+    # X-Forwarded-For/-Proto are trusted; 0 when clients connect directly.
+    app.config['PROXY_FIX_HOPS'] = int(os.environ.get('PROXY_FIX_HOPS', 1))
+    # Bearer token for /api/metrics; without one the endpoint is off (404).
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+    app.config.update(config or {})
+    # toolbar = DebugToolbarExtension(app)
+
+    # Secrets: from `config`, else the environment, else secrets2 (local development).
+    for key, local_name in (('SECRET_KEY', 'APP_SECRET_KEY'),
+                            ('ACCESS_TOKEN', 'ACCESS_TOKEN'),          # MapBox
+                            ('API_SECRET_KEY', 'API_SECRET_KEY')):
+        if not app.config.get(key):
+            app.config[key] = os.environ.get(key) or local_secret(local_name)
+
+    # request.remote_addr is the client, not the proxy (per-address login limits)
+    hops = app.config['PROXY_FIX_HOPS']
+    if hops:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=hops, x_proto=hops)
+
+    # Per-worker connection pool (see dbpool.py); gunicorn.conf.py sizes it
+    # so all workers together stay under Postgres max_connections.
+    # DB_PGBOUNCER=1 when DATABASE_URL is pgbouncer in transaction mode.
+    db_timeouts = {name: int(os.environ[var])
+                   for name, var in (('statement_timeout', 'DB_STATEMENT_TIMEOUT'),
+                                     ('lock_timeout', 'DB_LOCK_TIMEOUT'))
+                   if os.environ.get(var)}
+    pgbouncer = os.environ.get('DB_PGBOUNCER', '') == '1'
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', dbpool.engine_options(
+        app.config['SQLALCHEMY_DATABASE_URI'],
+        pool_size=int(os.environ['DB_POOL_SIZE']) if os.environ.get('DB_POOL_SIZE') else None,
+        max_overflow=int(os.environ['DB_MAX_OVERFLOW']) if os.environ.get('DB_MAX_OVERFLOW') else None,
+        pool_timeout=float(os.environ.get('DB_POOL_TIMEOUT', dbpool.DEFAULT_POOL_TIMEOUT)),
+        pool_recycle=int(os.environ.get('DB_POOL_RECYCLE', dbpool.DEFAULT_POOL_RECYCLE)),
+        pre_ping=os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+        timeouts=db_timeouts,
+        pgbouncer=pgbouncer))
+
+    connect_db(app)
+
+    if pgbouncer and db_timeouts:
+        with app.app_context():
+            dbpool.set_local_on_begin(db.engine, db_timeouts)
+
+    bcrypt.init_app(app)
+
+    # In-process geocoding cache, optionally backed by a shared table
+    # (e.g. GEOCODE_CACHE_URL=sqlite:///geocode_cache.db or the app database).
+    geocoding.configure_cache(
+        maxsize=int(os.environ.get('GEOCODE_CACHE_SIZE', 1024)),
+        ttl=int(os.environ.get('GEOCODE_CACHE_TTL', geocoding.DEFAULT_TTL)),
+        negative_ttl=int(os.environ.get('GEOCODE_CACHE_NEGATIVE_TTL', geocoding.DEFAULT_NEGATIVE_TTL)),
+        database_url=os.environ.get('GEOCODE_CACHE_URL'))
+
+    # Shared, pooled MapBox client: bounded timeouts/retries so a stalled
+    # MapBox can't hang a worker.
+    geocoding.configure_client(
+        connect_timeout=float(os.environ.get('GEOCODE_CONNECT_TIMEOUT', 3.05)),
+        read_timeout=float(os.environ.get('GEOCODE_READ_TIMEOUT', 5)),
+        max_retries=int(os.environ.get('GEOCODE_MAX_RETRIES', 2)))
+
+    # Per-worker cache of logged-in users' identities (see identity.py).
+    identity.configure_cache(ttl=int(os.environ.get('IDENTITY_CACHE_TTL', identity.DEFAULT_TTL)))
+
+    # Password hashing runs on a small bounded pool; beyond the queue limit
+    # logins are shed with 503 (see passwords.py).
+    passwords.configure_pool(
+        workers=int(os.environ.get('PASSWORD_POOL_WORKERS', passwords.DEFAULT_WORKERS)),
+        max_queue=int(os.environ.get('PASSWORD_POOL_QUEUE', passwords.DEFAULT_MAX_QUEUE)),
+        timeout=float(os.environ.get('PASSWORD_POOL_TIMEOUT', passwords.DEFAULT_TIMEOUT)))
+
+    # Login attempt limits per username and per client address, checked before
+    # bcrypt runs; LOGIN_THROTTLE_URL shares the counts across workers.
+    throttle.configure_throttle(
+        per_user=int(os.environ.get('LOGIN_LIMIT_PER_USER', throttle.DEFAULT_PER_USER)),
+        per_ip=int(os.environ.get('LOGIN_LIMIT_PER_IP', throttle.DEFAULT_PER_IP)),
+        window=int(os.environ.get('LOGIN_LIMIT_WINDOW', throttle.DEFAULT_WINDOW)),
+        database_url=os.environ.get('LOGIN_THROTTLE_URL'))
+
+    # Per-worker cache of rendered truck fragments ({% cache %} in templates; see fragments.py).
+    fragments.configure_cache(
+        maxsize=int(os.environ.get('FRAGMENT_CACHE_SIZE', fragments.DEFAULT_MAXSIZE)),
+        max_bytes=int(os.environ.get('FRAGMENT_CACHE_BYTES', fragments.DEFAULT_MAX_BYTES)))
+    app.jinja_env.add_extension(fragments.FragmentCacheExtension)
+
+    before_render_template.connect(start_lazy_load_guard, app)
+    template_rendered.connect(stop_lazy_load_guard, app)
+
+    app.register_blueprint(bp)
+
+    return app
+
+
+def local_secret(name):
+    """Return `name` from the untracked secrets2 module, or None without one."""
+
+    try:
+        import secrets2
+    except ImportError:
+        return None
+
+    return getattr(secrets2, name, None)
+
+
+def after_fork(app):
+    """Drop what a worker inherited from a preloading parent (gunicorn --preload).
+
+    Pooled DB connections are discarded without being closed (close=False),
+    so the parent's sockets are left alone and each worker opens its own.
+    The password pool is rebuilt because its threads don't survive a fork.
+    """
 
+    with app.app_context():
+        engines = set(db.engines.values())
 
-app = Flask(__name__)
+    engines.update(tier.engine for tier in getattr(geocoding.cache, 'tiers', ()) if hasattr(tier, 'engine'))
+    engines.update(limiter.engine for limiter in (throttle.throttle.per_user, throttle.throttle.per_ip)
+                   if hasattr(limiter, 'engine'))
 
-# Get DB_URI from environ variable (useful for production/testing) or,
-# if not set there, use development local db.
-app.config['SQLALCHEMY_DATABASE_URI'] = (
-    os.environ.get('DATABASE_URL', 'postgresql:///food_truck'))
+    for engine in engines:
+        engine.dispose(close=False)
 
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.config['SQLALCHEMY_ECHO'] = False
-app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', APP_SECRET_KEY)
-# toolbar = DebugToolbarExtension(app)
+    pool = passwords.pool
+    passwords.configure_pool(workers=pool.workers, max_queue=pool.max_queue, timeout=pool.timeout)
+
+
+##############################################################################
+# Lazy-load guard
+
+
+class LazyLoadError(Exception):
+    """A template lazy-loaded a relationship the view didn't eager-load."""
+
+
+def start_lazy_load_guard(sender, template, context, **extra):
+    g.rendering_template = template.name or "<template string>"
+
+
+def stop_lazy_load_guard(sender, template, context, **extra):
+    g.pop('rendering_template', None)
+
+
+@bp.teardown_app_request
+def reset_lazy_load_guard(exc):
+    # a render that raised never sent template_rendered, and g can outlive
+    # the request when a caller (test, CLI) holds an app context open
+    g.pop('rendering_template', None)
+
+
+@event.listens_for(db.session, "do_orm_execute")
+def lazy_load_guard(orm_execute_state):
+    """Raise LazyLoadError when a template triggers a relationship load, so
+    views must declare loader strategies (joinedload/selectinload) for
+    everything they render and each page's query count stays constant."""
+
+    if (orm_execute_state.is_relationship_load
+            and has_request_context()
+            and g.get('rendering_template')
+            and (current_app.config['RAISE_ON_LAZY_LOAD'] or current_app.debug)):
+        raise LazyLoadError(f"{g.rendering_template} lazy-loaded a relationship: "
+                            f"{orm_execute_state.statement}")
 
-app.app_context().push()
-connect_db(app)
-db.create_all()
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@bp.before_app_request
 def add_user_to_g():
-    """If logged in, add curr user to Flask global."""
+    """If logged in, add curr user's identity to Flask global.
+
+    g.user is a cached identity.Identity; views that need the full User
+    model use g.user.user.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = identity.cache.get(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -83,7 +279,86 @@ def business_auth(f):
     return decorated_function      
 
 
-@app.route('/signup', methods=["GET", "POST"])
+def encode_cursor(key):
+    """Return an opaque "load more" cursor for a page's next_key (None stays None)."""
+
+    if key is None:
+        return None
+
+    return base64.urlsafe_b64encode(str(key).encode()).decode().rstrip("=")
+
+
+def request_cursor():
+    """Return the next_key encoded in the 'cursor' query param, or None for the first page."""
+
+    cursor = request.args.get('cursor')
+
+    if not cursor:
+        return None
+
+    try:
+        return int(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError):
+        abort(400)
+
+
+def not_modified(version):
+    """Conditional GET for a page whose HTML is determined by `version` (the
+    data it shows) and who is viewing it.
+
+    Call before loading/rendering the page: returns a 304 response when the
+    client's If-None-Match copy is current, else None.  Either way the
+    response gets a strong ETag and caching headers (see
+    add_page_cache_headers).  No Last-Modified: its one-second resolution
+    would let two writes in the same second leave clients a stale copy.
+    Pages with flash messages pending are always rendered and get no validators.
+    """
+
+    if session.get('_flashes'):
+        return None
+
+    if g.user is None:
+        viewer = None
+    else:
+        viewer = (g.user.id, g.user.username, g.user.role, g.user.profile_image, sorted(g.user.favorite_ids))
+
+    etag = hashlib.sha1(repr((current_app.config['RELEASE'], request.full_path, version, viewer)).encode()).hexdigest()
+    g.page_etag = etag
+
+    if is_resource_modified(request.environ, etag=etag):
+        return None
+
+    return make_response("", 304)
+
+
+@bp.after_app_request
+def add_page_cache_headers(response):
+    """Add validators and Cache-Control to pages that called not_modified().
+
+    Anonymous pages are public (a CDN may keep them PAGE_CACHE_MAX_AGE
+    seconds); logged-in pages are private and revalidated every time.
+    """
+
+    etag = g.pop('page_etag', None)
+
+    if etag is None or response.status_code not in (200, 304):
+        return response
+
+    response.set_etag(etag)
+
+    if g.user is None:
+        response.cache_control.public = True
+        response.cache_control.max_age = current_app.config['PAGE_CACHE_MAX_AGE']
+    else:
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+
+    response.vary.add("Cookie")
+
+    return response
+
+
+@bp.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
 
@@ -95,6 +370,7 @@ def signup():
     and re-present form.
     """
 
+    from forms import UserAddForm
     form = UserAddForm()
 
     if form.validate_on_submit():   
@@ -129,7 +405,7 @@ def signup():
         return render_template('users/signup.html', form=form)
     
     
-@app.route('/truck_registration', methods=["GET", "POST"])
+@bp.route('/truck_registration', methods=["GET", "POST"])
 @user_auth
 @business_auth
 def register_truck():
@@ -142,13 +418,14 @@ def register_truck():
     and re-present form.
     """
 
-    user = g.user
+    user = g.user.user
 
      # User can only have one business profile
     if len(user.trucks) == 1:
         flash("Access denied. Business profile already exists.", "danger")
         return redirect("/")
 
+    from forms import TruckAddForm
     form = TruckAddForm()
 
     if form.validate_on_submit():
@@ -173,6 +450,8 @@ def register_truck():
             form.name.errors.append('Truck name already exists.')
             flash("Truck name already taken", 'danger')
             return render_template('trucks/signup.html', form=form)
+
+        update_truck_suggestions(truck)
         
         return redirect('/')
     
@@ -180,17 +459,27 @@ def register_truck():
         return render_template('trucks/signup.html', form=form)
 
 
-@app.route('/login', methods=["GET", "POST"])
+@bp.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
 
+    from forms import LoginForm
     form = LoginForm()
 
     if form.validate_on_submit():
+        # throttled before any password work is done
+        retry_after = throttle.throttle.attempt(form.username.data, request.remote_addr)
+
+        if retry_after:
+            flash("Too many login attempts. Please try again later.", 'danger')
+            return render_template('users/login.html', form=form), 429, {"Retry-After": str(math.ceil(retry_after))}
+
         user = User.authenticate(form.username.data,
                                  form.password.data)
 
         if user:
+            db.session.commit()         # saves a rehashed password, if any
+            throttle.throttle.succeeded(form.username.data)
             do_login(user)
             flash(f"Hello, {user.first_name}!", "success")
             return redirect("/")
@@ -200,7 +489,7 @@ def login():
     return render_template('users/login.html', form=form)
 
 
-@app.route('/logout')
+@bp.route('/logout')
 def logout():
     """Handle logout of user."""
 
@@ -212,57 +501,99 @@ def logout():
 ##############################################################################
 # General user routes:
 
-@app.route('/users/<int:user_id>')
+def user_profile(user_id, favorites=False):
+    """Return user with everything the profile header (users/detail.html)
+    renders already loaded, or 404.  Review and favorite badges are COUNT
+    subqueries; pass favorites=True to also load the favorited trucks."""
+
+    options = [selectinload(User.trucks).load_only(Truck.id, Truck.name),
+               undefer(User.review_count),
+               undefer(User.favorite_count)]
+
+    if favorites:
+        options.append(selectinload(User.favorites).load_only(Truck.id, Truck.name, Truck.logo_image, Truck.updated_at))
+
+    return User.query.options(*options).filter(User.id == user_id).first_or_404()
+
+
+@bp.route('/users/<int:user_id>')
 @user_auth
 def users_show(user_id):
     """Show user profile."""
 
-    user = User.query.get_or_404(user_id)
+    user = user_profile(user_id)
 
-    return render_template('users/show.html', user=user)
+    return render_template('users/show.html', user=user, recent_favorites=user.recent_favorites())
 
 
-@app.route('/users/<int:user_id>/favorites', methods=["GET"])
+@bp.route('/users/<int:user_id>/favorites', methods=["GET"])
 @user_auth
 def users_show_favorites(user_id):
     """Show a list of favorited food trucks by current logged-in user."""
     
-    user = User.query.get_or_404(user_id)
+    user = user_profile(user_id, favorites=True)
 
     return render_template('users/favorites.html', user=user, favorites=user.favorites)
 
 
-@app.route('/trucks/<int:truck_id>/favorite', methods=["POST"])
+def toggle_user_favorite(truck_id):
+    """Toggle truck_id in the logged-in user's favorites and commit.
+
+    Returns the new state (True = favorited), or None if it's the user's own
+    truck.  Runs a single DELETE (and INSERT if nothing was deleted) rather
+    than loading the user's favorites.
+    """
+
+    if Truck.query.with_entities(Truck.user_id).filter_by(id=truck_id).first_or_404().user_id == g.user.id:
+        return None
+
+    favorited = Favorite.toggle(g.user.id, truck_id)
+    db.session.commit()
+
+    # rows were written directly, so the flush listener didn't see them
+    identity.cache.invalidate(g.user.id)
+
+    return favorited
+
+
+@bp.route('/trucks/<int:truck_id>/favorite', methods=["POST"])
 @user_auth
 def toggle_favorite(truck_id):
     """Toggle a favorited food truck for current logged-in user."""
-    
-    truck = Truck.query.get_or_404(truck_id)
+
+    favorited = toggle_user_favorite(truck_id)
 
     # Handle case, logged in user cannot like their own truck
-    if truck.user_id == g.user.id:
+    if favorited is None:
         flash("Cannot favorite your own truck!", "danger")
-        redired_url = request.referrer or "/"
-        return redirect(redired_url)
-    
-    user_favorites = g.user.favorites
-
-    if truck in user_favorites:
-        # if the truck is contained in user's favorites --> remove truck --> outlined star
-        g.user.favorites = [favorite for favorite in user_favorites if favorite != truck]
-        flash("Truck successfully removed from favorites.", "success")
-    else:
-        # if the truck is not in the user's favorites --> add truck --> solid star
-        g.user.favorites.append(truck)
+    elif favorited:
+        # truck added to user's favorites --> solid star
         flash("Truck successfully added to favorites.", "success")
-
-    db.session.commit()
+    else:
+        # truck removed from user's favorites --> outlined star
+        flash("Truck successfully removed from favorites.", "success")
 
     redired_url = request.referrer or "/"
     return redirect(redired_url)
 
 
-@app.route('/trucks/<int:truck_id>/review', methods=["GET", "POST"])
+@bp.route('/api/trucks/<int:truck_id>/favorite', methods=["POST"])
+def api_toggle_favorite(truck_id):
+    """Toggle a favorited food truck for current logged-in user; return JSON
+    {truck_id, favorited} with the new state instead of redirecting."""
+
+    if g.user is None:
+        return jsonify(error="login required"), 401
+
+    favorited = toggle_user_favorite(truck_id)
+
+    if favorited is None:
+        return jsonify(error="cannot favorite your own truck"), 403
+
+    return jsonify(truck_id=truck_id, favorited=favorited)
+
+
+@bp.route('/trucks/<int:truck_id>/review', methods=["GET", "POST"])
 @user_auth
 def add_review(truck_id):
     """ Add a review for truck for logged-in user."""
@@ -275,6 +606,7 @@ def add_review(truck_id):
         redired_url = request.referrer or "/"
         return redirect(redired_url)
 
+    from forms import UserReviewForm
     form = UserReviewForm()
 
     if form.validate_on_submit():
@@ -289,7 +621,7 @@ def add_review(truck_id):
             image_4 = form.image_4.data or None,
         )
 
-        g.user.reviews.append(review)
+        db.session.add(review)
         db.session.commit()
         flash("Review successfully submitted!", "success")
 
@@ -298,17 +630,21 @@ def add_review(truck_id):
     return render_template('trucks/review.html', form=form, truck=truck, user=g.user)
 
 
-@app.route('/users/<int:user_id>/reviews', methods=["GET"])
+@bp.route('/users/<int:user_id>/reviews', methods=["GET"])
 @user_auth
 def users_show_reviews(user_id):
     """Show a list of food trucks reviewed by current logged-in user."""
     
-    user = User.query.get_or_404(user_id)
+    user = user_profile(user_id)
 
-    return render_template('users/reviews.html', user=user, reviews=user.reviews)
+    reviews, next_key = Review.user_page(user_id, before=request_cursor(),
+                                         options=[joinedload(Review.trucks).load_only(Truck.id, Truck.name, Truck.logo_image)])
 
+    return render_template('users/reviews.html', user=user, reviews=reviews,
+                           next_cursor=encode_cursor(next_key))
 
-@app.route('/users/reviews/<int:review_id>/edit', methods=["GET", "POST"])
+
+@bp.route('/users/reviews/<int:review_id>/edit', methods=["GET", "POST"])
 @user_auth
 def edit_review(review_id):
     """Update review for logged in-user."""
@@ -322,14 +658,15 @@ def edit_review(review_id):
         redired_url = request.referrer or "/"
         return redirect(redired_url)
 
+    from forms import UserReviewEditForm
     form = UserReviewEditForm(obj=reviewObj)
 
     if form.validate_on_submit():
-        reviewObj.rating = form.rating.data,
-        reviewObj.review = form.review.data,
-        reviewObj.image_1 = form.image_1.data or None,
-        reviewObj.image_2 = form.image_2.data or None,
-        reviewObj.image_3 = form.image_3.data or None,
+        reviewObj.rating = form.rating.data
+        reviewObj.review = form.review.data
+        reviewObj.image_1 = form.image_1.data or None
+        reviewObj.image_2 = form.image_2.data or None
+        reviewObj.image_3 = form.image_3.data or None
         reviewObj.image_4 = form.image_4.data or None
 
         db.session.commit()
@@ -339,7 +676,7 @@ def edit_review(review_id):
     return render_template("/users/review_edit.html", user=user, review=reviewObj, form=form)
 
 
-@app.route('/users/reviews/<int:review_id>/delete', methods=["GET"])
+@bp.route('/users/reviews/<int:review_id>/delete', methods=["GET"])
 @user_auth
 def delete_review(review_id):
     """Delete a logged-in user's specific review."""
@@ -359,16 +696,17 @@ def delete_review(review_id):
     return redirect(f"/users/{ g.user.id }/reviews")
 
 
-@app.route('/users/profile', methods=["GET", "POST"])
+@bp.route('/users/profile', methods=["GET", "POST"])
 @user_auth
 def edit_profile():
     """Update profile for current user."""
 
-    user = g.user
+    user = g.user.user
+    from forms import UserEditForm
     form = UserEditForm(obj=user)
     
     if form.validate_on_submit():
-        if User.authenticate(user.username, form.password.data):
+        if user.check_password(form.password.data):
             user.username=form.username.data,
             user.email=form.email.data,
             user.first_name=form.first_name.data,
@@ -390,12 +728,13 @@ def edit_profile():
     return render_template('users/edit.html', form=form, user_id=user.id)
 
 
-@app.route('/users/change_password', methods=["GET", "POST"])
+@bp.route('/users/change_password', methods=["GET", "POST"])
 @user_auth
 def change_password():
     """Show form for logged-in user to change password. Update password if current password is correct."""
     
-    user = g.user
+    user = g.user.user
+    from forms import ChangePasswordForm
     form = ChangePasswordForm()
 
     if form.validate_on_submit():
@@ -404,11 +743,11 @@ def change_password():
         new_password_confirm = form.new_password_confirm.data
 
     # Check whether current password matches what user enters
-        if User.authenticate(user.username, current_password):
+        if user.check_password(current_password):
             
             # New password and confirm new password fields must match
             if new_password == new_password_confirm:
-                User.update_password(user.username, new_password)
+                user.set_password(new_password)
                 try:
                     db.session.commit()
                 except IntegrityError:
@@ -425,66 +764,117 @@ def change_password():
     return render_template("users/change_password.html", form=form, user_id=user.id)
 
 
-@app.route('/users/delete', methods=["POST"])
+@bp.route('/users/delete', methods=["POST"])
 @user_auth
 def delete_user():
     """Delete logged-in user account."""
 
     do_logout()
 
-    db.session.delete(g.user)
+    user = g.user.user
+    truck_ids = [truck.id for truck in user.trucks]
+
+    db.session.delete(user)
     db.session.commit()
 
+    for truck_id in truck_ids:
+        clustering.index.remove(truck_id)
+        suggest.index.remove(truck_id)
+
     return redirect("/signup")
 
 
 ##############################################################################
 # General truck routes:
 
-@app.route('/trucks')
+def format_rating(truck):
+    """Return a truck's (or truck summary's) average rating rounded for display, or "None"."""
+
+    if truck is None or not truck.review_count:
+        return "None"
+
+    return round(truck.average_rating, 1)
+
+
+@bp.route('/trucks')
 def list_trucks():
     """Page with listing of trucks.
     
-    Can take a 'q' param in querystring to search by that truck.
+    Can take a 'q' param in querystring to search trucks by name, bio or
+    location (best matches first), and a 'cursor' param for the next page.
     """
 
-    search = request.args.get('q')
+    search = request.args.get('q', '').strip()
 
-    if not search:
-        trucks = Truck.query.all()
-    else:
-        trucks = Truck.query.filter(Truck.name.like(f"%{search}%")).all()
+    # truck inserts/deletes and edits to listed columns bump the counter (one-row lookup)
+    response = not_modified(TableVersion.current("trucks"))
+    if response is not None:
+        return response
+
+    trucks, next_key = Truck.search(search, after=request_cursor())
+
+    return render_template('trucks/index.html', trucks=trucks, user=g.user,
+                           search=search, next_cursor=encode_cursor(next_key))
+
+
+@bp.route('/trucks/nearby')
+def nearby_trucks():
+    """Return JSON list of trucks near a point, closest first.
+
+    Takes 'lat' and 'lng' params and an optional 'radius' in miles (default 10).
+    """
 
-    return render_template('trucks/index.html', trucks=trucks, user=g.user)
+    try:
+        lat = float(request.args['lat'])
+        lng = float(request.args['lng'])
+        radius = float(request.args.get('radius', 10))
+    except (KeyError, ValueError):
+        return jsonify(error="lat and lng are required numbers; radius must be a number"), 400
 
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180) or not (0 < radius <= 500):
+        return jsonify(error="lat/lng out of range or radius not in (0, 500] miles"), 400
 
-@app.route('/trucks/<int:truck_id>', methods=["GET"])
+    trucks = [{"id": truck.id,
+               "name": truck.name,
+               "logo_image": truck.logo_image,
+               "location": truck.location,
+               "place_name": truck.place_name,
+               "latitude": truck.latitude,
+               "longitude": truck.longitude,
+               "average_rating": format_rating(truck),
+               "distance": round(distance, 2)}
+              for distance, truck in Truck.nearby(lat, lng, radius)]
+
+    return jsonify(trucks=trucks)
+
+
+@bp.route('/trucks/<int:truck_id>', methods=["GET"])
 def truck_show(truck_id):
     """Show a specified truck profile."""
 
-    truck = Truck.query.get_or_404(truck_id)
-    
-    # average rating query
-    t = text(f'SELECT AVG(rating) as average_rating FROM reviews WHERE truck_id = {truck_id}')
-    average_rating = db.session.execute(t).first()[0]
+    version = Truck.page_version(truck_id)
 
-    if truck.reviews:
-        rounded = round(average_rating, 1)
-    else:
-        rounded = "None"
+    if version is None:
+        abort(404)
+
+    response = not_modified(version)
+    if response is not None:
+        return response
 
-    reviews = (Review
-            .query
-            .filter(Review.truck_id == truck_id)
-            .order_by(Review.id.desc())
-            .limit(4)
-            .all())
+    detail = Truck.detail(truck_id)
+
+    if detail is None:
+        abort(404)
+
+    truck, reviews = detail
+
+    rounded = format_rating(truck)
 
     return render_template('trucks/show.html', 
                            truck=truck, user=g.user, average_rating=rounded, reviews=reviews)
 
 
-@app.route('/trucks/profile', methods=["GET", "POST"])
+@bp.route('/trucks/profile', methods=["GET", "POST"])
 @user_auth
 @business_auth
 def truck_edit():
@@ -492,7 +882,7 @@ def truck_edit():
         Only truck owner can edit profile.
     """
     
-    user = g.user
+    user = g.user.user
     
     truckObj = user.trucks[0]
 
@@ -501,17 +891,18 @@ def truck_edit():
         flash("Access unauthorized", "danger")
         return redirect('/')
     
+    from forms import TruckEditForm
     form = TruckEditForm(obj=truckObj)    # user can only have 1 truck per account
 
     if form.validate_on_submit():
-        if User.authenticate(user.username, form.password.data):
-            truckObj.name = form.name.data,
-            truckObj.email=form.email.data,
-            truckObj.phone_number=form.phone_number.data,
-            truckObj.logo_image=form.logo_image.data or Truck.logo_image.default.arg,
-            truckObj.menu_image=form.menu_image.data,
-            truckObj.social_media_1=form.social_media_1.data or None,
-            truckObj.social_media_2=form.social_media_2.data or None,
+        if user.check_password(form.password.data):
+            truckObj.name = form.name.data
+            truckObj.email=form.email.data
+            truckObj.phone_number=form.phone_number.data
+            truckObj.logo_image=form.logo_image.data or Truck.logo_image.default.arg
+            truckObj.menu_image=form.menu_image.data
+            truckObj.social_media_1=form.social_media_1.data or None
+            truckObj.social_media_2=form.social_media_2.data or None
             truckObj.bio=form.bio.data
 
             try:
@@ -520,6 +911,9 @@ def truck_edit():
                 flash("New username/email already taken", "danger")
                 return redirect(f"/users/{user.id}")
             
+            update_truck_marker(truckObj)
+            update_truck_suggestions(truckObj)
+
             flash("Profile updated successfully!", "success")
             return redirect(f"/users/{user.id}")
         
@@ -528,7 +922,7 @@ def truck_edit():
     return render_template('trucks/edit.html', form=form, user_id=user.id)
 
 
-@app.route('/trucks/<int:truck_id>/location', methods=["GET", "POST"])
+@bp.route('/trucks/<int:truck_id>/location', methods=["GET", "POST"])
 @user_auth
 @business_auth
 def truck_location(truck_id):
@@ -543,94 +937,332 @@ def truck_location(truck_id):
         flash("Access unauthorized", "danger")
         return redirect('/')
 
+    from forms import TruckLocationForm
     form = TruckLocationForm(obj=truck)
 
     if form.validate_on_submit():
         truck.open_time = form.open_time.data,
         truck.close_time = form.close_time.data,
-        truck.location = form.location.data
-        
-        if truck.location:
-            truck.latitude = truck.request_coords(GEOCODE_API_BASE_URL, ACCESS_TOKEN, truck.location)["lat"]
-            truck.longitude = truck.request_coords(GEOCODE_API_BASE_URL, ACCESS_TOKEN, truck.location)["lng"]
+
+        # Geocode once here so rendering pages never has to call MapBox.
+        try:
+            found = truck.update_location(GEOCODE_API_BASE_URL, current_app.config['ACCESS_TOKEN'], form.location.data)
+        except geocoding.GeocodingError:
+            flash("Location service is unavailable. Please try again later.", "danger")
+            return render_template('trucks/location.html', form=form, truck=truck, user=user)
+
+        if not found:
+            form.location.errors.append('Location not found.')
+            flash("Unable to find that location. Please try again.", "danger")
+            return render_template('trucks/location.html', form=form, truck=truck, user=user)
 
         db.session.commit()
+        update_truck_marker(truck)
+        update_truck_suggestions(truck)
+
         flash("Location successfully updated!", "success")
         return redirect(f"/trucks/{truck_id}")
     
     return render_template('trucks/location.html', form=form, truck=truck, user=user)
     
 
-@app.route('/trucks/<int:truck_id>/reviews', methods=["GET"])
+@bp.route('/trucks/<int:truck_id>/reviews', methods=["GET"])
 @user_auth
 def truck_list_reviews(truck_id):
     """Show a list of all reviews for a specified truck for logged-in user."""
     
-    truck = Truck.query.get_or_404(truck_id)
+    before = request_cursor()
+
+    # review writes bump the truck's updated_at; author renames don't
+    version = Truck.page_version(truck_id, n_reviews=REVIEWS_PER_PAGE, before=before)
+
+    if version is None:
+        abort(404)
+
+    response = not_modified(version)
+    if response is not None:
+        return response
+
+    truck = db.session.get(Truck, truck_id)
+
+    reviews, next_key = Review.truck_page(truck_id, before=before, per_page=REVIEWS_PER_PAGE,
+                                          options=[joinedload(Review.users).load_only(User.id, User.first_name, User.last_name)])
+
+    return render_template('trucks/reviews.html', reviews=reviews, user=g.user, truck=truck,
+                           next_cursor=encode_cursor(next_key))
+
+
+##############################################################################
+# Map data
+
+@bp.route('/api/trucks.geojson')
+def trucks_geojson():
+    """Return trucks as a GeoJSON FeatureCollection.
+
+    Takes an optional 'bbox' param (minLng,minLat,maxLng,maxLat) to return
+    only trucks in the visible map area, and an optional 'zoom' param: when
+    given, nearby trucks are merged into server-side clusters (features with
+    `cluster: true` and a `point_count`) until zoomed in far enough.
+    Responses carry a strong ETag (304 on If-None-Match) and are gzipped
+    when the client accepts it.
+    """
+
+    bbox = request.args.get('bbox', '-180,-90,180,90')
+
+    try:
+        min_lng, min_lat, max_lng, max_lat = (float(n) for n in bbox.split(','))
+    except ValueError:
+        return jsonify(error="bbox must be minLng,minLat,maxLng,maxLat"), 400
+
+    zoom = request.args.get('zoom', type=float)
+
+    # nan/inf parse as floats but aren't zoom levels
+    if zoom is not None and not math.isfinite(zoom):
+        return jsonify(error="zoom must be a number"), 400
+
+    if zoom is not None:
+        zoom = min(max(zoom, 0), MAX_MAP_ZOOM)
+        features = cluster_index().features(zoom, (min_lng, min_lat, max_lng, max_lat))
+    else:
+        features = [{"type": "Feature",
+                     "id": truck.id,
+                     "geometry": {"type": "Point", "coordinates": [truck.longitude, truck.latitude]},
+                     "properties": {"id": truck.id, **truck_marker_properties(truck)}}
+                    for truck in Truck.in_bbox(min_lng, min_lat, max_lng, max_lat)]
+
+    body = json.dumps({"type": "FeatureCollection", "features": features}, separators=(",", ":"))
+
+    return cacheable_json(body, max_age=30)
+
+
+def truck_marker_properties(truck):
+    """Return the map popup fields for a truck (or truck summary row)."""
+
+    return {"name": truck.name,
+            "logo": truck.logo_image,
+            "place_name": truck.place_name or truck.location}
+
+
+def cluster_index():
+    """Return the marker cluster index, (re)building it from the database when stale."""
+
+    index = clustering.index
+
+    if index.stale:
+        index.rebuild((truck.id, truck.longitude, truck.latitude, truck_marker_properties(truck))
+                      for truck in Truck.in_bbox(-180, -90, 180, 90))
+
+    return index
+
+
+def update_truck_marker(truck):
+    """Apply one truck's new location/details to the cluster index."""
+
+    clustering.index.update(truck.id, truck.longitude, truck.latitude, truck_marker_properties(truck))
+
+
+def suggest_index():
+    """Return the type-ahead index, (re)building it from the database when stale."""
+
+    index = suggest.index
+
+    if index.stale:
+        index.rebuild(db.session.query(Truck.id, Truck.name, Truck.place_name))
+
+    return index
+
+
+def update_truck_suggestions(truck):
+    """Apply one truck's new name/place to the type-ahead index."""
+
+    suggest.index.add(truck.id, truck.name, truck.place_name)
 
-    reviews = (Review
-               .query
-               .filter(Review.truck_id == truck_id)
-               .order_by(Review.id.desc())
-               .limit(50)
-               .all())
 
-    return render_template('trucks/reviews.html', reviews=reviews, user=g.user, truck=truck)
+@bp.route('/api/trucks/suggest')
+def suggest_trucks():
+    """Return JSON {suggestions: [{id, name, location}]} for trucks whose name
+    or location has a word starting with the 'prefix' param (up to 'limit', max 20)."""
+
+    prefix = request.args.get('prefix', '')
+    limit = min(max(request.args.get('limit', 8, type=int), 1), 20)
+
+    response = jsonify(suggestions=suggest_index().suggest(prefix, limit=limit))
+    response.cache_control.public = True
+    response.cache_control.max_age = 30
+
+    return response
+
+
+def cacheable_json(body, max_age):
+    """Return a JSON response for `body` with ETag/If-None-Match and gzip handling."""
+
+    etag = hashlib.sha1(body.encode()).hexdigest()
+    gzipped = "gzip" in request.headers.get("Accept-Encoding", "") and len(body) > 500
+
+    # different encodings are different representations: give them distinct strong ETags
+    if gzipped:
+        etag += "-gz"
+
+    if request.if_none_match.contains(etag):
+        response = make_response("", 304)
+    else:
+        data = gzip.compress(body.encode(), compresslevel=6) if gzipped else body.encode()
+        response = make_response(data)
+        response.content_type = "application/geo+json" if request.path.endswith(".geojson") else "application/json"
+        if gzipped:
+            response.headers["Content-Encoding"] = "gzip"
+
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = f"public, max-age={max_age}"
+    response.vary.add("Accept-Encoding")
+
+    return response
 
 
 ##############################################################################
 # Homepage and error pages
 
-@app.route('/')
+@bp.route('/')
 def homepage():
     """Show homepage:
 
     - anon users: no map or trucks
     - logged in: map populated with registered trucks and list below
-    """
 
-    locations = ""
-    truck_names = []
-    truck_logos = []
-    truck_ids = []
-    rounded = []
+    The map itself fetches markers for the visible area from
+    /api/trucks.geojson, so no truck data is embedded in the page script.
+    """
 
     if g.user:
-        # Retrieve truck locations from database. Add to LOCATIONS string.
-        trucks = Truck.query.all()
-        for truck in trucks:
-            # last element, move semicolon
-            if truck == trucks[-1]:
-                locations += f"{truck.longitude},{truck.latitude}"
-            else:
-               locations += f"{truck.longitude},{truck.latitude};"
-
-            # prepare JS lists
-            truck_names.append(truck.name)
-            truck_logos.append(truck.logo_image)
-            truck_ids.append(truck.id)
-
-            # average rating query
-            t = text(f'SELECT AVG(rating) as average_rating FROM reviews WHERE truck_id = {truck.id}')
-            average_rating = db.session.execute(t).first()[0]
-
-            if truck.reviews:
-                rounded.append(round(average_rating, 1))
-            else:
-                rounded.append("None")
-
-        url = f"{GEOCODE_API_BASE_URL}.places-permanent/{locations}.json?access_token={ACCESS_TOKEN}"
-        response = requests.get(url)
-        r = response.json()
-
-        return render_template('home.html', url=url, trucks=trucks, truck_names=truck_names, truck_logos=truck_logos, truck_ids=truck_ids, average_rating=rounded, ACCESS_TOKEN=ACCESS_TOKEN, resp=r)
+        # Retrieve truck summaries (with aggregate ratings) in one query.
+        trucks = Truck.summaries()
+        rounded = [format_rating(truck) for truck in trucks]
+
+        return render_template('home.html', trucks=trucks, average_rating=rounded,
+                               ACCESS_TOKEN=current_app.config['ACCESS_TOKEN'])
 
     else:
         return render_template('home-anon.html')
     
 
-@app.errorhandler(404)
+@bp.app_errorhandler(passwords.PasswordPoolBusy)
+def password_pool_busy(e):
+    """Shed password work (logins, signups) when the password pool is full."""
+
+    db.session.rollback()
+
+    return "Too many sign-ins right now; please try again in a moment.", 503, {"Retry-After": "1"}
+
+
+@bp.app_errorhandler(PoolTimeoutError)
+def db_pool_exhausted(e):
+    """Shed requests that waited DB_POOL_TIMEOUT seconds without getting a database connection."""
+
+    db.session.rollback()
+
+    return "We're very busy right now; please try again in a moment.", 503, {"Retry-After": "1"}
+
+
+@bp.app_errorhandler(404)
 def page_not_found(e):
     """404 NOT FOUND page."""
 
-    return render_template('404.html'), 404
\ No newline at end of file
+    return render_template('404.html'), 404
+
+
+##############################################################################
+# Internal metrics
+
+@bp.route('/api/metrics')
+def metrics():
+    """Return this worker's cache and pool counters as JSON (for sizing them).
+
+    Requires `Authorization: Bearer <METRICS_TOKEN>`.
+    """
+
+    token = current_app.config['METRICS_TOKEN']
+
+    if not token:
+        abort(404)
+
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {token}"):
+        abort(401)
+
+    return jsonify(geocode_cache=geocoding.cache.stats(),
+                   geocode_client=geocoding.client.stats(),
+                   identity_cache=identity.cache.stats(),
+                   fragment_cache=fragments.cache.stats(),
+                   password_pool=passwords.pool.stats(),
+                   login_throttle=throttle.throttle.stats(),
+                   db_pool=dbpool.stats(db.engine))
+
+
+##############################################################################
+# CLI commands
+
+@bp.cli.command("init-db")
+def init_db():
+    """Create the tables for a new database and mark every migration applied."""
+
+    db.create_all()
+    marked = migrate.mark_applied(db.engine, migrate.migration_files()[-1][0])
+    click.echo(f"Created tables; marked {len(marked)} migration(s) applied.")
+
+
+@bp.cli.command("backfill-places")
+def backfill_places():
+    """Store reverse-geocoded place names for trucks that have coordinates but none saved."""
+
+    trucks = (Truck
+              .query
+              .filter(Truck.place_name.is_(None),
+                      Truck.latitude.isnot(None),
+                      Truck.longitude.isnot(None))
+              .all())
+
+    for truck in trucks:
+        try:
+            truck.place_name = Truck.request_place_name(GEOCODE_API_BASE_URL, current_app.config['ACCESS_TOKEN'],
+                                                        truck.longitude, truck.latitude)
+        except geocoding.GeocodingError as e:
+            click.echo(f"{truck.id}: skipped ({e})")
+            continue
+        click.echo(f"{truck.id}: {truck.place_name}")
+
+    db.session.commit()
+    click.echo(f"Backfilled {len(trucks)} truck(s).")
+
+
+@bp.cli.command("reconcile-ratings")
+def reconcile_ratings():
+    """Rebuild every truck's denormalized rating aggregates from its reviews."""
+
+    fixed = Truck.reconcile_ratings()
+    db.session.commit()
+    click.echo(f"Reconciled ratings: {fixed} truck(s) corrected.")
+
+
+@bp.cli.command("migrate")
+@click.option("--list", "list_only", is_flag=True, help="Only list pending migrations.")
+@click.option("--mark-applied", metavar="VERSION",
+              help="Record migrations up to VERSION as applied without running them "
+                   "(for a database already migrated by hand).")
+def migrate_db(list_only, mark_applied):
+    """Apply pending SQL migrations from migrations/ in order."""
+
+    if mark_applied:
+        for filename in migrate.mark_applied(db.engine, mark_applied):
+            click.echo(f"marked {filename}")
+        return
+
+    if list_only:
+        for version, filename in migrate.pending(db.engine):
+            click.echo(filename)
+        return
+
+    applied = migrate.migrate(db.engine, echo=click.echo)
+    click.echo(f"Applied {len(applied)} migration(s).")
+
+
+# The app `flask --app app`, gunicorn (app:app) and the tests use.
+app = create_app()
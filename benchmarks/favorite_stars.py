@@ -0,0 +1,119 @@
+"""Benchmark: /trucks render time for a user with many favorites.
+
+Compares the old favorite-star check ({% if truck in user.favorites %},
+which loads every favorited Truck and scans the list for each card) with
+id-set membership ({% if truck.id in g.user.favorite_ids %}).
+
+run like:
+
+    python3 benchmarks/favorite_stars.py [--trucks 1000] [--favorites 500] [--repeat 20]
+
+Uses a throwaway SQLite database unless BENCH_DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', f"sqlite:///{db_file}")
+
+from flask import g, render_template_string
+
+from app import app, CURR_USER_KEY
+from models import db, User, Truck, Favorite
+import identity
+
+# one app context for the whole script (the app doesn't push one itself)
+app.app_context().push()
+
+OLD_STAR = "{% if truck in user.favorites %}"
+NEW_STAR = "{% if truck.id in g.user.favorite_ids %}"
+
+
+def seed(n_trucks, n_favorites):
+    """Create one business owner with n_trucks trucks and a user favoriting n_favorites of them."""
+
+    db.drop_all()
+    db.create_all()
+
+    owner = User.signup("owner", "owner@email.com", "Own", "Er", "password", None, "business")
+    fan = User.signup("fan", "fan@email.com", "F", "An", "password", None, "personal")
+    db.session.flush()
+
+    db.session.add_all(Truck(name=f"Truck {i}", email=f"truck{i}@email.com", phone_number="5555555555",
+                             menu_image="/static/images/menu.jpg", user_id=owner.id)
+                       for i in range(n_trucks))
+    db.session.flush()
+
+    truck_ids = [truck_id for (truck_id,) in db.session.query(Truck.id).order_by(Truck.id).limit(n_favorites)]
+    db.session.add_all(Favorite(user_id=fan.id, truck_id=truck_id) for truck_id in truck_ids)
+    db.session.commit()
+
+    return fan.id
+
+
+def time_it(fn, repeat):
+    """Return the best of `repeat` runs, in milliseconds."""
+
+    best = float("inf")
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trucks", type=int, default=1000)
+    parser.add_argument("--favorites", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    user_id = seed(args.trucks, args.favorites)
+
+    index_html = open(os.path.join(app.root_path, "templates/trucks/index.html")).read()
+    old_html = index_html.replace(NEW_STAR, OLD_STAR)
+
+    def render_before():
+        # fresh session per request, as in the app: user.favorites is lazy-loaded again
+        db.session.remove()
+        with app.test_request_context("/trucks"):
+            g.user = user = db.session.get(User, user_id)
+            trucks = Truck.query.all()
+            render_template_string(old_html, trucks=trucks, user=user)
+
+    def render_after():
+        db.session.remove()
+        with app.test_request_context("/trucks"):
+            g.user = identity.cache.get(user_id)
+            render_template_string(index_html, trucks=Truck.summaries(), user=g.user)
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+    def request_after():
+        resp = client.get("/trucks")
+        assert resp.status_code == 200
+
+    before = time_it(render_before, args.repeat)
+    after = time_it(render_after, args.repeat)
+    request = time_it(request_after, args.repeat)
+
+    print(f"{args.trucks} trucks, {args.favorites} favorites (best of {args.repeat}):")
+    print(f"  before  truck in user.favorites         {before:8.1f} ms")
+    print(f"  after   truck.id in g.user.favorite_ids {after:8.1f} ms")
+    print(f"  GET /trucks (after, first page)         {request:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""Benchmark: truck detail page latency for a truck with many reviews.
+
+Compares the old detail page data access (get_or_404, an AVG over the
+truck's reviews, the whole truck.reviews collection, then a latest-4
+query) with Truck.detail(), one query for the truck and its latest
+reviews with authors; then times GET /trucks/<id> end to end.
+
+run like:
+
+    python3 benchmarks/truck_detail.py [--reviews 10000] [--repeat 200]
+
+Uses a throwaway SQLite database unless BENCH_DATABASE_URL is set.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+db_file = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ['DATABASE_URL'] = os.environ.get('BENCH_DATABASE_URL', f"sqlite:///{db_file}")
+
+from sqlalchemy import func
+
+from app import app, CURR_USER_KEY
+from models import db, User, Truck, Review
+
+# one app context for the whole script (the app doesn't push one itself)
+app.app_context().push()
+
+
+def seed(n_reviews):
+    """Create one truck with n_reviews reviews spread over 100 reviewers; return (truck id, a reviewer id)."""
+
+    db.drop_all()
+    db.create_all()
+
+    owner = User.signup("owner", "owner@email.com", "Own", "Er", "password", None, "business")
+    db.session.flush()
+
+    truck = Truck(name="Bench Truck", email="bench@email.com", phone_number="5555555555",
+                  menu_image="/static/images/menu.jpg", user_id=owner.id)
+    db.session.add(truck)
+    db.session.flush()
+
+    # bcrypt per signup is slow; reviewers share one hash
+    password = owner.password
+    db.session.add_all(User(username=f"fan{i}", email=f"fan{i}@email.com", first_name="F", last_name=f"An{i}",
+                            password=password, role="personal")
+                       for i in range(100))
+    db.session.flush()
+
+    fan_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.role == "personal")]
+
+    db.session.bulk_insert_mappings(Review, [{"user_id": fan_ids[i % len(fan_ids)], "truck_id": truck.id,
+                                              "rating": (i % 11) / 2, "review": f"Review number {i}."}
+                                             for i in range(n_reviews)])
+    db.session.commit()
+    Truck.reconcile_ratings()
+    db.session.commit()
+
+    return truck.id, fan_ids[0]
+
+
+def percentiles(fn, repeat):
+    """Return (p50, p99) of `repeat` runs, in milliseconds."""
+
+    times = []
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+
+    cuts = statistics.quantiles(times, n=100)
+
+    return cuts[49], cuts[98]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--reviews", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    truck_id, user_id = seed(args.reviews)
+
+    def load_before():
+        # fresh session per request, as in the app
+        db.session.remove()
+        truck = Truck.query.get_or_404(truck_id)
+        db.session.query(func.avg(Review.rating)).filter(Review.truck_id == truck_id).scalar()
+        len(truck.reviews)
+        reviews = Review.query.filter(Review.truck_id == truck_id).order_by(Review.id.desc()).limit(4).all()
+        [review.users.full_name for review in reviews]
+
+    def load_after():
+        db.session.remove()
+        truck, reviews = Truck.detail(truck_id)
+        [review.users.full_name for review in reviews]
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+    def request_after():
+        resp = client.get(f"/trucks/{truck_id}")
+        assert resp.status_code == 200
+
+    print(f"1 truck, {args.reviews} reviews ({args.repeat} runs):  p50 / p99")
+
+    for label, fn in (("before  get + AVG + truck.reviews + latest 4", load_before),
+                      ("after   Truck.detail (one query)           ", load_after),
+                      ("GET /trucks/<id> (after)                   ", request_after)):
+        p50, p99 = percentiles(fn, args.repeat)
+        print(f"  {label} {p50:8.2f} / {p99:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
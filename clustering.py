@@ -0,0 +1,209 @@
+"""Server-side map marker clustering for Food Locator App.
+
+Trucks are bucketed into a pixel grid for every zoom level (Web Mercator,
+`cell_size` screen pixels per cell).  At low zoom the map gets one feature
+per occupied cell with a count; past `max_zoom` it gets individual trucks.
+Buckets are precomputed and kept current incrementally as trucks move, so
+a map request only walks the cells in view.
+"""
+
+import math
+import threading
+import time
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878          # Web Mercator limit
+
+
+def project(lng, lat, zoom):
+    """Return Web Mercator pixel (x, y) of a lng/lat point at `zoom`."""
+
+    lat = max(min(lat, MAX_LATITUDE), -MAX_LATITUDE)
+    scale = TILE_SIZE * 2 ** zoom
+    sin_lat = math.sin(math.radians(lat))
+
+    x = (lng + 180) / 360 * scale
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+
+    return x, y
+
+
+def in_bbox(lng, lat, bbox):
+    """Is (lng, lat) inside bbox (min_lng, min_lat, max_lng, max_lat)?
+
+    A box with min_lng > max_lng is taken to cross the antimeridian.
+    """
+
+    min_lng, min_lat, max_lng, max_lat = bbox
+
+    if not min_lat <= lat <= max_lat:
+        return False
+    if min_lng <= max_lng:
+        return min_lng <= lng <= max_lng
+    return lng >= min_lng or lng <= max_lng
+
+
+class Cluster:
+    """Trucks sharing a grid cell at one zoom level."""
+
+    __slots__ = ("ids", "sum_lng", "sum_lat")
+
+    def __init__(self):
+        self.ids = set()
+        self.sum_lng = 0.0
+        self.sum_lat = 0.0
+
+    @property
+    def centroid(self):
+        return self.sum_lng / len(self.ids), self.sum_lat / len(self.ids)
+
+
+class ClusterIndex:
+    """Grid clusters of truck points for zoom levels 0..max_zoom."""
+
+    def __init__(self, max_zoom=14, cell_size=60, max_age=60, clock=time.monotonic):
+        self.max_zoom = max_zoom
+        self.cell_size = cell_size
+        self.max_age = max_age
+        self.clock = clock
+        self.built_at = None
+        self.points = {}                                        # id -> (lng, lat, properties)
+        self.grids = [{} for zoom in range(max_zoom + 1)]       # zoom -> {(cx, cy): Cluster}
+        self._lock = threading.RLock()
+
+    def _cell(self, lng, lat, zoom):
+        x, y = project(lng, lat, zoom)
+        return int(x // self.cell_size), int(y // self.cell_size)
+
+    def add(self, truck_id, lng, lat, properties):
+        """Add (or move) a truck."""
+
+        with self._lock:
+            self.remove(truck_id)
+            self.points[truck_id] = (lng, lat, properties)
+
+            for zoom, grid in enumerate(self.grids):
+                cluster = grid.setdefault(self._cell(lng, lat, zoom), Cluster())
+                cluster.ids.add(truck_id)
+                cluster.sum_lng += lng
+                cluster.sum_lat += lat
+
+    def remove(self, truck_id):
+        """Remove a truck if present."""
+
+        with self._lock:
+            point = self.points.pop(truck_id, None)
+
+            if point is None:
+                return
+
+            lng, lat, properties = point
+
+            for zoom, grid in enumerate(self.grids):
+                cell = self._cell(lng, lat, zoom)
+                cluster = grid[cell]
+                cluster.ids.discard(truck_id)
+                cluster.sum_lng -= lng
+                cluster.sum_lat -= lat
+
+                if not cluster.ids:
+                    del grid[cell]
+
+    def update(self, truck_id, lng, lat, properties):
+        """Reflect a truck's current location: moved, added, or (no coords) removed."""
+
+        if lng is None or lat is None:
+            self.remove(truck_id)
+        else:
+            self.add(truck_id, lng, lat, properties)
+
+    def rebuild(self, trucks):
+        """Replace the index contents with `trucks`: iterable of (id, lng, lat, properties)."""
+
+        with self._lock:
+            self.points = {}
+            self.grids = [{} for zoom in range(self.max_zoom + 1)]
+
+            for truck_id, lng, lat, properties in trucks:
+                self.add(truck_id, lng, lat, properties)
+
+            self.built_at = self.clock()
+
+    def invalidate(self):
+        """Force a rebuild on next use."""
+
+        self.built_at = None
+
+    @property
+    def stale(self):
+        """Needs a rebuild: never built, or older than max_age (other workers'
+        writes only reach this worker's index through a rebuild)."""
+
+        return self.built_at is None or self.clock() - self.built_at > self.max_age
+
+    def features(self, zoom, bbox):
+        """Return GeoJSON features in bbox at zoom: clusters, or single trucks."""
+
+        zoom = max(int(zoom), 0)
+
+        with self._lock:
+            if zoom > self.max_zoom:
+                # zoomed in past clustering: the finest grid still narrows the search
+                return [self._point_feature(truck_id)
+                        for cell, cluster in self._cells_in_view(self.max_zoom, bbox)
+                        for truck_id in cluster.ids
+                        if in_bbox(*self.points[truck_id][:2], bbox)]
+
+            features = []
+
+            for (cx, cy), cluster in self._cells_in_view(zoom, bbox):
+                lng, lat = cluster.centroid
+
+                if not in_bbox(lng, lat, bbox):
+                    continue
+
+                if len(cluster.ids) == 1:
+                    features.append(self._point_feature(next(iter(cluster.ids))))
+                else:
+                    features.append({"type": "Feature",
+                                     "id": f"cluster-{zoom}-{cx}-{cy}",
+                                     "geometry": {"type": "Point", "coordinates": [round(lng, 6), round(lat, 6)]},
+                                     "properties": {"cluster": True,
+                                                    "point_count": len(cluster.ids),
+                                                    "expansion_zoom": min(zoom + 2, self.max_zoom + 1)}})
+
+            return features
+
+    def _cells_in_view(self, zoom, bbox):
+        """Yield (cell, cluster) for occupied cells overlapping bbox."""
+
+        grid = self.grids[zoom]
+        min_lng, min_lat, max_lng, max_lat = bbox
+
+        if min_lng > max_lng:
+            # antimeridian: not worth being clever, filter every cluster
+            yield from grid.items()
+            return
+
+        x0, y0 = self._cell(min_lng, max_lat, zoom)
+        x1, y1 = self._cell(max_lng, min_lat, zoom)
+
+        # walk whichever is smaller: the cells in view, or the occupied cells
+        if (x1 - x0 + 1) * (y1 - y0 + 1) < len(grid):
+            for cx in range(x0, x1 + 1):
+                for cy in range(y0, y1 + 1):
+                    if (cx, cy) in grid:
+                        yield (cx, cy), grid[(cx, cy)]
+        else:
+            yield from grid.items()
+
+    def _point_feature(self, truck_id):
+        lng, lat, properties = self.points[truck_id]
+
+        return {"type": "Feature",
+                "id": truck_id,
+                "geometry": {"type": "Point", "coordinates": [lng, lat]},
+                "properties": {"id": truck_id, **properties}}
+
+
+index = ClusterIndex()
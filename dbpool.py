@@ -0,0 +1,126 @@
+"""Database connection pool settings and metrics for Food Locator App.
+
+engine_options() builds SQLALCHEMY_ENGINE_OPTIONS:
+
+- pool_size / max_overflow:  connections kept open / extra ones allowed
+                             under load (gunicorn.conf.py sizes these per worker).
+- pool_timeout:  seconds a request waits for a free connection before the
+                 app answers 503; short, so a lunch rush sheds load
+                 instead of queueing every worker behind the pool.
+- pool_recycle:  replace connections older than this many seconds.
+- pre_ping:      test connections on checkout, so ones broken by a
+                 failover or restart are replaced instead of failing requests.
+- timeouts:      Postgres settings such as statement_timeout and
+                 lock_timeout (milliseconds), set for every connection.
+- pgbouncer:     the URL points at pgbouncer in transaction pooling mode.
+                 pgbouncer rejects settings sent at connection startup and
+                 may switch server connections between transactions, so
+                 timeouts are set with SET LOCAL at the start of each
+                 transaction instead (set_local_on_begin), and server-side
+                 prepared statements are turned off (psycopg 3; psycopg2
+                 never uses them).
+
+The pool is a MeteredQueuePool, which counts checkouts, time spent waiting
+for a connection and checkout timeouts, for /api/metrics.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+DEFAULT_POOL_TIMEOUT = 5
+DEFAULT_POOL_RECYCLE = 1800
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+    def stats(self):
+        return {"size": self.size(), "checked_out": self.checkedout(), "idle": self.checkedin(),
+                "overflow": max(self.overflow(), 0), "max_overflow": self._max_overflow,
+                "checkouts": self.checkouts, "timeouts": self.timeouts,
+                "wait_ms_total": round(self.wait_total * 1000, 3),
+                "wait_ms_max": round(self.wait_max * 1000, 3)}
+
+
+def engine_options(url, pool_size=None, max_overflow=None, pool_timeout=DEFAULT_POOL_TIMEOUT,
+                   pool_recycle=DEFAULT_POOL_RECYCLE, pre_ping=True, timeouts=None, pgbouncer=False):
+    """Return create_engine() keyword arguments for the database at `url`."""
+
+    url = make_url(url)
+    options = {"pool_pre_ping": pre_ping}
+
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return options                  # one shared connection (StaticPool); nothing to size
+
+    options.update(poolclass=MeteredQueuePool, pool_timeout=pool_timeout, pool_recycle=pool_recycle)
+
+    if pool_size is not None:
+        options["pool_size"] = pool_size
+    if max_overflow is not None:
+        options["max_overflow"] = max_overflow
+
+    if url.get_backend_name() != "postgresql":
+        return options
+
+    connect_args = {}
+
+    if pgbouncer:
+        if url.get_driver_name() == "psycopg":
+            connect_args["prepare_threshold"] = None
+    elif timeouts:
+        connect_args["options"] = " ".join(f"-c {name}={value}" for name, value in timeouts.items())
+
+    if connect_args:
+        options["connect_args"] = connect_args
+
+    return options
+
+
+def set_local_on_begin(engine, settings):
+    """SET LOCAL each of `settings` at the start of every transaction on engine."""
+
+    statements = [f"SET LOCAL {name} = {int(value)}" for name, value in settings.items()]
+
+    @event.listens_for(engine, "begin")
+    def set_local(conn):
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+
+
+def stats(engine):
+    """Return the engine's pool counters (or just its status for other pool classes)."""
+
+    pool = engine.pool
+
+    if isinstance(pool, MeteredQueuePool):
+        return pool.stats()
+
+    return {"status": pool.status()}
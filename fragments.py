@@ -0,0 +1,162 @@
+"""Rendered template fragment cache for Food Locator App.
+
+Templates wrap markup that depends only on one truck in
+
+    {% cache "truck-card", truck.id, truck.updated_at %} ... {% endcache %}
+
+and the rendered HTML is kept per worker under the key ("truck-card",
+truck id, updated_at).  Every write to a truck (including the rating
+aggregates a review write moves) bumps `updated_at`, so a fragment cached
+by any worker is never served for a newer version of its truck.  Writes
+through this worker's session also drop that truck's fragments at once,
+which keeps superseded versions from filling the cache.
+
+Anything per user (the favorite star, owner-only buttons) must stay
+outside the cached block, and anything else it shows that isn't the
+truck's (review authors' names) must be added to the key.
+"""
+
+import threading
+from collections import OrderedDict
+
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+
+from models import Truck, Review
+
+DEFAULT_MAXSIZE = 4096
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+
+class FragmentCache:
+    """LRU of rendered fragments, bounded by entry count and total size."""
+
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, max_bytes=DEFAULT_MAX_BYTES):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.bytes = 0
+        self._entries = OrderedDict()        # key -> html
+        self._by_truck = {}                  # truck id -> {keys}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached HTML for key, or None."""
+
+        with self._lock:
+            html = self._entries.get(key)
+
+            if html is None:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return html
+
+    def set(self, key, html):
+        """Cache html under key, a (fragment name, truck id, version...) tuple."""
+
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = html
+            self._by_truck.setdefault(key[1], set()).add(key)
+            self.bytes += len(html)
+
+            while len(self._entries) > self.maxsize or self.bytes > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _discard(self, key):
+        html = self._entries.pop(key, None)
+
+        if html is None:
+            return
+
+        self.bytes -= len(html)
+
+        keys = self._by_truck.get(key[1])
+        keys.discard(key)
+        if not keys:
+            del self._by_truck[key[1]]
+
+    def invalidate_truck(self, truck_id):
+        """Drop every cached fragment of truck_id."""
+
+        with self._lock:
+            for key in self._by_truck.pop(truck_id, ()):
+                self.bytes -= len(self._entries.pop(key))
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_truck.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {"size": len(self._entries), "maxsize": self.maxsize,
+                "bytes": self.bytes, "max_bytes": self.max_bytes,
+                "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None}
+
+
+cache = FragmentCache()
+
+
+def configure_cache(maxsize=DEFAULT_MAXSIZE, max_bytes=DEFAULT_MAX_BYTES):
+    """Replace the module cache."""
+
+    global cache
+
+    cache = FragmentCache(maxsize=maxsize, max_bytes=max_bytes)
+
+    return cache
+
+
+class FragmentCacheExtension(Extension):
+    """Jinja `{% cache name, truck_id, version... %}...{% endcache %}` tag."""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+
+        args = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            args.append(parser.parse_expression())
+
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+
+        return nodes.CallBlock(self.call_method("_render", [nodes.List(args)]), [], [], body).set_lineno(lineno)
+
+    def _render(self, key, caller):
+        key = tuple(key)
+        html = cache.get(key)
+
+        if html is None:
+            html = caller()
+            cache.set(key, html)
+
+        return Markup(html)
+
+
+@event.listens_for(Truck, "after_update")
+@event.listens_for(Truck, "after_delete")
+def invalidate_truck_fragments(mapper, connection, truck):
+    cache.invalidate_truck(truck.id)
+
+
+@event.listens_for(Review, "after_insert")
+@event.listens_for(Review, "after_update")
+@event.listens_for(Review, "after_delete")
+def invalidate_review_truck_fragments(mapper, connection, review):
+    cache.invalidate_truck(review.truck_id)
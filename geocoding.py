@@ -0,0 +1,441 @@
+"""MapBox geocoding client (timeouts, retries, circuit breaker) and address cache."""
+
+import math
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import MetaData, Table, Column, Text, Float, Boolean, create_engine, select, delete
+
+
+class GeocodingError(Exception):
+    """MapBox could not be reached or returned an error."""
+
+
+class CircuitOpenError(GeocodingError):
+    """MapBox has been failing; requests are rejected without being sent."""
+
+
+class CircuitBreaker:
+    """Fail fast after `failure_threshold` consecutive failures; retry after `reset_timeout` seconds."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if self.clock() - self.opened_at >= self.reset_timeout:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """Return True if a request may be sent now."""
+
+        with self._lock:
+            if self.state == "open":
+                return False
+            if self.state == "half-open":
+                # let one trial through; push the window so others keep failing fast
+                self.opened_at = self.clock()
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+
+
+class MapboxClient:
+    """Pooled HTTP client for MapBox with timeouts, retries and a circuit breaker."""
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, connect_timeout=3.05, read_timeout=5, max_retries=2, backoff=0.2,
+                 pool_size=10, failure_threshold=5, reset_timeout=30, sleep=time.sleep):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.counters = {"requests": 0, "retries": 0, "failures": 0, "rejected": 0}
+        self.pool_size = pool_size
+        self._session = None
+
+    @property
+    def session(self):
+        """The pooled requests.Session, created (and `requests` imported) on first use."""
+
+        if self._session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            self._session = session
+
+        return self._session
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    def get_json(self, url):
+        """Return the JSON body of GET `url`; raises GeocodingError (or CircuitOpenError)."""
+
+        if not self.breaker.allow():
+            self.counters["rejected"] += 1
+            raise CircuitOpenError("MapBox circuit breaker is open")
+
+        import requests
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.counters["retries"] += 1
+                # full jitter: spread retries out so workers don't retry in lockstep
+                self.sleep(random.uniform(0, self.backoff * 2 ** (attempt - 1)))
+
+            self.counters["requests"] += 1
+
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = GeocodingError(f"MapBox request failed: {e}")
+                continue
+
+            if response.status_code in self.RETRY_STATUSES:
+                error = GeocodingError(f"MapBox returned {response.status_code}")
+                continue
+
+            if not response.ok:
+                # client errors (bad token, bad request) won't improve with retries
+                self.breaker.record_success()
+                raise GeocodingError(f"MapBox returned {response.status_code}")
+
+            self.breaker.record_success()
+            return response.json()
+
+        self.counters["failures"] += 1
+        self.breaker.record_failure()
+        raise error
+
+    def stats(self):
+        return {"circuit": self.breaker.state, **self.counters}
+
+
+client = MapboxClient()
+
+
+def configure_client(**options):
+    """Replace the module client (see MapboxClient for options)."""
+
+    global client
+
+    client.close()
+    client = MapboxClient(**options)
+
+    return client
+
+
+EARTH_RADIUS_MILES = 3958.8
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """Return great-circle distance in miles between two (lat, lng) points."""
+
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlmb = math.radians(lng2 - lng1)
+
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+
+def bounding_box(lat, lng, radius):
+    """Return (min_lat, max_lat, min_lng, max_lng) enclosing a `radius` mile circle (min_lng > max_lng across ±180)."""
+
+    dlat = math.degrees(radius / EARTH_RADIUS_MILES)
+    min_lat, max_lat = max(lat - dlat, -90.0), min(lat + dlat, 90.0)
+
+    # near the poles (or for huge radii) the circle spans every longitude
+    cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+    if cos_lat <= 1e-9 or dlat / cos_lat >= 180:
+        return min_lat, max_lat, -180.0, 180.0
+
+    dlng = dlat / cos_lat
+    min_lng, max_lng = lng - dlng, lng + dlng
+
+    # past the antimeridian: wrap round, as Truck.in_bbox expects
+    if min_lng < -180:
+        min_lng += 360
+    if max_lng > 180:
+        max_lng -= 360
+
+    return min_lat, max_lat, min_lng, max_lng
+
+
+# Returned by `get()` when a key isn't cached (None means "cached: no result").
+MISS = object()
+
+DEFAULT_TTL = 60 * 60 * 24 * 30         # 30 days
+DEFAULT_NEGATIVE_TTL = 60 * 60          # 1 hour
+
+
+def normalize_address(address):
+    """Return a cache key for `address`: lowercase, single-spaced, tidy commas."""
+
+    address = address.strip().lower()
+    address = re.sub(r"\s*,\s*", ", ", address)
+    address = re.sub(r"\s+", " ", address)
+
+    return address.strip(" ,.")
+
+
+class CacheStats:
+    """Hit/miss/eviction counters for a cache."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def as_dict(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+class MemoryGeocodeCache:
+    """In-process LRU cache with a TTL per entry."""
+
+    def __init__(self, maxsize=1024, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.counters = CacheStats()
+        self._entries = OrderedDict()        # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return cached value for key (None for a cached "no result"), or MISS."""
+
+        entry = self.get_entry(key)
+
+        return entry if entry is MISS else entry[1]
+
+    def get_entry(self, key):
+        """Return (expires_at, value) for key, or MISS."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                self.counters.misses += 1
+                return MISS
+
+            if entry[0] <= self.clock():
+                del self._entries[key]
+                self.counters.expirations += 1
+                self.counters.misses += 1
+                return MISS
+
+            self._entries.move_to_end(key)
+            self.counters.hits += 1
+            return entry
+
+    def set(self, key, value, expires_at=None):
+        """Cache value for key until `expires_at` (default: after the TTL).  `value=None` records a "no result" answer."""
+
+        if expires_at is None:
+            expires_at = self.clock() + (self.ttl if value is not None else self.negative_ttl)
+
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.counters.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {"backend": "memory", "size": len(self._entries), "maxsize": self.maxsize,
+                **self.counters.as_dict()}
+
+
+class DatabaseGeocodeCache:
+    """Geocoding cache in a SQL table, shared across workers (own engine, outside request transactions)."""
+
+    metadata = MetaData()
+
+    table = Table("geocode_cache", metadata,
+                  Column("address", Text, primary_key=True),
+                  Column("found", Boolean, nullable=False),
+                  Column("lat", Float),
+                  Column("lng", Float),
+                  Column("place_name", Text),
+                  Column("expires_at", Float, nullable=False))
+
+    def __init__(self, url_or_engine, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, clock=time.time):
+        if isinstance(url_or_engine, str):
+            url_or_engine = create_engine(url_or_engine)
+
+        self.engine = url_or_engine
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock
+        self.counters = CacheStats()
+        self._table_ready = False
+        self._table_lock = threading.Lock()
+
+    def _ensure_table(self):
+        """Create the table on first use (not at startup)."""
+
+        if not self._table_ready:
+            with self._table_lock:
+                if not self._table_ready:
+                    self.metadata.create_all(self.engine)
+                    self._table_ready = True
+
+    def get(self, key):
+        """Return cached value for key (None for a cached "no result"), or MISS."""
+
+        entry = self.get_entry(key)
+
+        return entry if entry is MISS else entry[1]
+
+    def get_entry(self, key):
+        """Return (expires_at, value) for key, or MISS."""
+
+        self._ensure_table()
+
+        with self.engine.connect() as conn:
+            row = conn.execute(select(self.table).where(self.table.c.address == key)).first()
+
+        if row is None:
+            self.counters.misses += 1
+            return MISS
+
+        if row.expires_at <= self.clock():
+            self.counters.expirations += 1
+            self.counters.misses += 1
+            return MISS
+
+        self.counters.hits += 1
+
+        if not row.found:
+            return row.expires_at, None
+
+        return row.expires_at, {"lat": row.lat, "lng": row.lng, "place_name": row.place_name}
+
+    def set(self, key, value, expires_at=None):
+        """Cache value for key until `expires_at` (default: after the TTL).  `value=None` records a "no result" answer."""
+
+        if expires_at is None:
+            expires_at = self.clock() + (self.ttl if value is not None else self.negative_ttl)
+
+        value = value or {}
+        row = {"address": key,
+               "found": bool(value),
+               "lat": value.get("lat"),
+               "lng": value.get("lng"),
+               "place_name": value.get("place_name"),
+               "expires_at": expires_at}
+
+        if self.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        stmt = insert(self.table).values(**row)
+        stmt = stmt.on_conflict_do_update(index_elements=[self.table.c.address],
+                                          set_={k: v for k, v in row.items() if k != "address"})
+
+        self._ensure_table()
+
+        with self.engine.begin() as conn:
+            conn.execute(stmt)
+
+    def clear(self):
+        self._ensure_table()
+
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table))
+
+    def stats(self):
+        return {"backend": "database", **self.counters.as_dict()}
+
+
+class TieredGeocodeCache:
+    """Check caches in order (e.g. memory, then database); fill faster tiers on a hit, expiring with it."""
+
+    def __init__(self, *tiers):
+        self.tiers = tiers
+
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            entry = tier.get_entry(key)
+
+            if entry is not MISS:
+                expires_at, value = entry
+                for faster in self.tiers[:i]:
+                    faster.set(key, value, expires_at=expires_at)
+                return value
+
+        return MISS
+
+    def set(self, key, value):
+        for tier in self.tiers:
+            tier.set(key, value)
+
+    def clear(self):
+        for tier in self.tiers:
+            tier.clear()
+
+    def stats(self):
+        return {"backend": "tiered", "tiers": [tier.stats() for tier in self.tiers]}
+
+
+cache = MemoryGeocodeCache()
+
+
+def configure_cache(maxsize=1024, ttl=DEFAULT_TTL, negative_ttl=DEFAULT_NEGATIVE_TTL, database_url=None):
+    """Replace the module cache: in-process LRU, backed by a table at `database_url` if given."""
+
+    global cache
+
+    cache = MemoryGeocodeCache(maxsize=maxsize, ttl=ttl, negative_ttl=negative_ttl)
+
+    if database_url:
+        cache = TieredGeocodeCache(cache, DatabaseGeocodeCache(database_url, ttl=ttl, negative_ttl=negative_ttl))
+
+    return cache
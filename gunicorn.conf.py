@@ -0,0 +1,64 @@
+"""Gunicorn settings for Food Locator App.
+
+Run with:  gunicorn app:app        (gunicorn reads ./gunicorn.conf.py)
+
+The app is preloaded in the master (GUNICORN_PRELOAD=0 to turn off):
+modules are imported and templates compiled once, then shared with the
+forked workers copy-on-write instead of being rebuilt in each one.
+Importing the app opens no connections, and post_fork discards any the
+master did open, so workers never share a Postgres socket.
+
+Each worker's connection pool gets an equal share of Postgres
+connections: (PG_MAX_CONNECTIONS - PG_RESERVED_CONNECTIONS) // workers,
+`threads` of them kept open and the rest as overflow.  The sizes are
+passed to create_app() as DB_POOL_SIZE / DB_MAX_OVERFLOW unless those
+are set already.  Set the worker count with WEB_CONCURRENCY (not -w) so
+the share is computed from it.
+
+Workers are threaded (gthread), so one process serves several requests
+at once and the password pool's limit matters: at most half of a
+worker's threads may be busy with bcrypt (running or queued); further
+logins get 503 while the other threads keep serving pages.
+"""
+
+import gc
+import multiprocessing
+import os
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+# Postgres connections left for psql, migrations and other clients.
+connections = (int(os.environ.get('PG_MAX_CONNECTIONS', 100))
+               - int(os.environ.get('PG_RESERVED_CONNECTIONS', 10)))
+per_worker = max(connections // workers, 1)
+
+os.environ.setdefault('DB_POOL_SIZE', str(min(threads, per_worker)))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(per_worker - min(threads, per_worker)))
+
+# Password pool (see passwords.py) sized to the threads: workers + queue = threads // 2.
+password_workers = int(os.environ.setdefault('PASSWORD_POOL_WORKERS', str(max(min(2, threads // 2), 1))))
+os.environ.setdefault('PASSWORD_POOL_QUEUE', str(max(threads // 2 - password_workers, 0)))
+
+
+def when_ready(server):
+    """Compile every template in the master and freeze the heap before workers fork."""
+
+    if not server.cfg.preload_app:
+        return
+
+    from app import app
+
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+    # keep the collector from touching (and so copying) the shared objects
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    if server.cfg.preload_app:
+        from app import app, after_fork
+        after_fork(app)
@@ -0,0 +1,130 @@
+"""Current-user identity cache for Food Locator App.
+
+Every request needs to know who is logged in, and most pages only need a
+few columns of the user (navbar picture, role checks, favorite stars).
+`Identity` holds just those, and `cache` keeps them per worker for a short
+TTL so a request doesn't have to hit the database to find them.  The full
+ORM `User` is loaded only when a view asks for `identity.user`.
+
+Entries are dropped when the user, or one of their favorites, is written
+through this worker's session; the TTL bounds how long other workers can
+serve a stale copy.
+"""
+
+import threading
+import time
+
+from sqlalchemy import event
+
+from models import db, User, Favorite
+
+DEFAULT_TTL = 30        # seconds
+
+
+class Identity:
+    """Logged-in user's id, username, role, profile image and favorite truck ids."""
+
+    __slots__ = ("id", "username", "role", "profile_image", "favorite_ids")
+
+    def __init__(self, id, username, role, profile_image, favorite_ids=()):
+        self.id = id
+        self.username = username
+        self.role = role
+        self.profile_image = profile_image
+        self.favorite_ids = frozenset(favorite_ids)
+
+    @property
+    def user(self):
+        """The full ORM User (one query on first use per request session)."""
+
+        return db.session.get(User, self.id)
+
+    @classmethod
+    def load(cls, user_id):
+        """Return the Identity for user_id from the database, or None if there's no such user."""
+
+        rows = (db.session
+                .query(User.id, User.username, User.role, User.profile_image, Favorite.truck_id)
+                .outerjoin(Favorite, Favorite.user_id == User.id)
+                .filter(User.id == user_id)
+                .all())
+
+        if not rows:
+            return None
+
+        id, username, role, profile_image, truck_id = rows[0]
+
+        return cls(id, username, role, profile_image,
+                   (row.truck_id for row in rows if row.truck_id is not None))
+
+    def __repr__(self):
+        return f"<Identity #{self.id}: {self.username}>"
+
+
+class IdentityCache:
+    """Identities by user id, each kept for `ttl` seconds."""
+
+    def __init__(self, ttl=DEFAULT_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = {}          # user id -> (expires_at, Identity)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return the Identity for user_id, loading it on a miss (None if no such user)."""
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+
+        if entry is not None and entry[0] > self.clock():
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        identity = Identity.load(user_id)
+
+        if identity is not None:
+            with self._lock:
+                self._entries[user_id] = (self.clock() + self.ttl, identity)
+
+        return identity
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {"size": len(self._entries), "ttl": self.ttl, "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else None}
+
+
+cache = IdentityCache()
+
+
+def configure_cache(ttl=DEFAULT_TTL):
+    """Replace the module cache."""
+
+    global cache
+
+    cache = IdentityCache(ttl=ttl)
+
+    return cache
+
+
+@event.listens_for(db.session, "after_flush")
+def invalidate_identities(session, flush_context):
+    """Drop cached identities of users written (or whose favorites were written) in this flush."""
+
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, User):
+            cache.invalidate(obj.id)
+        elif isinstance(obj, Favorite):
+            cache.invalidate(obj.user_id)
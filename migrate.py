@@ -0,0 +1,116 @@
+"""Versioned schema migrations for Food Locator App.
+
+Migrations are the SQL files in migrations/, applied in filename order.
+The leading number of each filename is its version; applied versions are
+recorded in the `schema_migrations` table so each file runs once.
+
+Each file runs in its own transaction together with its version record.
+A file containing the line
+
+    -- migrate: no-transaction
+
+is run statement by statement outside a transaction instead (needed for
+CREATE INDEX CONCURRENTLY).  Its statements must each end with `;` at the
+end of a line.
+
+Run with:  flask --app app migrate
+"""
+
+import os
+import re
+
+from sqlalchemy import MetaData, Table, Column, Text, DateTime, func, select
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+NO_TRANSACTION = "-- migrate: no-transaction"
+
+metadata = MetaData()
+
+schema_migrations = Table("schema_migrations", metadata,
+                          Column("version", Text, primary_key=True),
+                          Column("name", Text, nullable=False),
+                          Column("applied_at", DateTime, nullable=False, server_default=func.now()))
+
+
+def migration_files(directory=MIGRATIONS_DIR):
+    """Return [(version, filename), ...] for migrations in directory, in order."""
+
+    files = []
+
+    for filename in sorted(os.listdir(directory)):
+        match = re.match(r"(\d+)_.*\.sql$", filename)
+        if match:
+            files.append((match.group(1), filename))
+
+    return files
+
+
+def applied_versions(engine):
+    """Return the set of migration versions recorded as applied."""
+
+    metadata.create_all(engine)
+
+    with engine.connect() as conn:
+        return {version for (version,) in conn.execute(select(schema_migrations.c.version))}
+
+
+def pending(engine, directory=MIGRATIONS_DIR):
+    """Return [(version, filename), ...] not yet applied."""
+
+    applied = applied_versions(engine)
+
+    return [(version, filename) for version, filename in migration_files(directory) if version not in applied]
+
+
+def split_statements(sql):
+    """Split SQL into statements at semicolons that end a line."""
+
+    return [statement.strip() for statement in re.split(r";\s*$", sql, flags=re.MULTILINE) if statement.strip()]
+
+
+def apply(engine, version, filename, directory=MIGRATIONS_DIR):
+    """Run one migration file and record its version."""
+
+    with open(os.path.join(directory, filename)) as f:
+        sql = f.read()
+
+    record = schema_migrations.insert().values(version=version, name=filename)
+
+    if NO_TRANSACTION in sql:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT", no_parameters=True) as conn:
+            for statement in split_statements(sql):
+                conn.exec_driver_sql(statement)
+            conn.execute(record)
+        return
+
+    with engine.begin() as conn:
+        conn.execution_options(no_parameters=True).exec_driver_sql(sql)
+        conn.execute(record)
+
+
+def migrate(engine, directory=MIGRATIONS_DIR, echo=print):
+    """Apply pending migrations in order.  Return the filenames applied."""
+
+    applied = []
+
+    for version, filename in pending(engine, directory):
+        echo(f"applying {filename}")
+        apply(engine, version, filename, directory)
+        applied.append(filename)
+
+    return applied
+
+
+def mark_applied(engine, through_version, directory=MIGRATIONS_DIR):
+    """Record migrations up to and including through_version as applied without
+    running them (for databases migrated by hand with psql).  Return the filenames."""
+
+    marked = [(version, filename) for version, filename in pending(engine, directory)
+              if int(version) <= int(through_version)]
+
+    if marked:
+        with engine.begin() as conn:
+            conn.execute(schema_migrations.insert(),
+                         [{"version": version, "name": filename} for version, filename in marked])
+
+    return [filename for version, filename in marked]
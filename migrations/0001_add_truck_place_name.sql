@@ -0,0 +1,7 @@
+-- Store the reverse-geocoded place name alongside each truck's coordinates
+-- so the homepage map can be rendered without calling MapBox.
+--
+-- Apply with:  psql -d food_truck -f migrations/0001_add_truck_place_name.sql
+-- then populate existing rows with:  flask --app app backfill-places
+
+ALTER TABLE trucks ADD COLUMN IF NOT EXISTS place_name text;
@@ -0,0 +1,23 @@
+-- Store truck coordinates as numbers so distance queries can run in SQL,
+-- and index them for bounding-box ("trucks near me") prefilters.
+--
+-- Values that aren't plain decimal numbers become NULL (re-geocode them by
+-- updating the truck's location).
+--
+-- Apply with:  psql -d food_truck -f migrations/0002_numeric_truck_coordinates.sql
+
+-- (skipped when the columns are already numeric, e.g. created by db.create_all())
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+         WHERE table_name = 'trucks' AND column_name = 'latitude') IN ('text', 'character varying') THEN
+        ALTER TABLE trucks
+            ALTER COLUMN latitude TYPE double precision
+                USING CASE WHEN trim(latitude) ~ '^-?[0-9]+(\.[0-9]+)?$' THEN trim(latitude)::double precision END,
+            ALTER COLUMN longitude TYPE double precision
+                USING CASE WHEN trim(longitude) ~ '^-?[0-9]+(\.[0-9]+)?$' THEN trim(longitude)::double precision END;
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_trucks_latitude_longitude ON trucks (latitude, longitude);
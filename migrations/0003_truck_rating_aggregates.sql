@@ -0,0 +1,38 @@
+-- Denormalized rating aggregates on trucks (review count, rating sum and a
+-- 0-5 star histogram), maintained by the app on every review write.
+-- Existing rows are populated from the reviews table here; run
+-- `flask --app app reconcile-ratings` at any time to rebuild them.
+--
+-- Apply with:  psql -d food_truck -f migrations/0003_truck_rating_aggregates.sql
+
+ALTER TABLE trucks
+    ADD COLUMN IF NOT EXISTS review_count integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS rating_sum double precision NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS stars_0 integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS stars_1 integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS stars_2 integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS stars_3 integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS stars_4 integer NOT NULL DEFAULT 0,
+    ADD COLUMN IF NOT EXISTS stars_5 integer NOT NULL DEFAULT 0;
+
+UPDATE trucks
+SET review_count = agg.review_count,
+    rating_sum = agg.rating_sum,
+    stars_0 = agg.stars_0,
+    stars_1 = agg.stars_1,
+    stars_2 = agg.stars_2,
+    stars_3 = agg.stars_3,
+    stars_4 = agg.stars_4,
+    stars_5 = agg.stars_5
+FROM (SELECT truck_id,
+             count(*) AS review_count,
+             sum(rating) AS rating_sum,
+             count(*) FILTER (WHERE least(floor(rating), 5) = 0) AS stars_0,
+             count(*) FILTER (WHERE least(floor(rating), 5) = 1) AS stars_1,
+             count(*) FILTER (WHERE least(floor(rating), 5) = 2) AS stars_2,
+             count(*) FILTER (WHERE least(floor(rating), 5) = 3) AS stars_3,
+             count(*) FILTER (WHERE least(floor(rating), 5) = 4) AS stars_4,
+             count(*) FILTER (WHERE least(floor(rating), 5) = 5) AS stars_5
+      FROM reviews
+      GROUP BY truck_id) AS agg
+WHERE trucks.id = agg.truck_id;
@@ -0,0 +1,14 @@
+-- One favorite row per (user, truck), enforced by a unique index that also
+-- serves the toggle's INSERT ... ON CONFLICT DO NOTHING and DELETE lookups.
+--
+-- Apply with:  psql -d food_truck -f migrations/0004_favorites_unique_user_truck.sql
+
+-- drop duplicate favorites left by earlier double-submits, keeping the oldest
+DELETE FROM favorites f
+ USING favorites older
+ WHERE f.user_id = older.user_id
+   AND f.truck_id = older.truck_id
+   AND f.id > older.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS ix_favorites_user_id_truck_id
+    ON favorites (user_id, truck_id);
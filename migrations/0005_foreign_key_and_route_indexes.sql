@@ -0,0 +1,22 @@
+-- Secondary indexes for the hot lookups, one per query shape:
+--
+--   ix_reviews_truck_id_id    truck page / truck reviews: latest reviews of a
+--                             truck (WHERE truck_id = ? ORDER BY id DESC LIMIT n)
+--   ix_reviews_user_id_id     user reviews page: a user's reviews, newest first
+--   ix_favorites_truck_id     deleting a truck (cascade) / who favorited a truck
+--                             (favorites.user_id is covered by the unique
+--                             (user_id, truck_id) index from 0004)
+--   ix_trucks_user_id         user.trucks (business owner's truck)
+--
+-- Built CONCURRENTLY so writes to large tables aren't blocked meanwhile.
+--
+-- Applied by:  flask --app app migrate
+-- migrate: no-transaction
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reviews_truck_id_id ON reviews (truck_id, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_reviews_user_id_id ON reviews (user_id, id DESC);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_favorites_truck_id ON favorites (truck_id);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_trucks_user_id ON trucks (user_id);
@@ -0,0 +1,22 @@
+-- Ranked, typo-tolerant truck search (Truck.search):
+--
+--   search_vector         weighted tsvector over name (A), bio (B) and
+--                         place name/location (C), generated by Postgres so
+--                         it can't drift from the row
+--   ix_trucks_search_vector  GIN full-text index (@@ websearch_to_tsquery)
+--   ix_trucks_name_trgm      GIN trigram index (q <% name, ILIKE)
+--
+-- Applied by:  flask --app app migrate
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+ALTER TABLE trucks ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(bio, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(place_name, '') || ' ' || coalesce(location, '')), 'C')
+    ) STORED;
+
+CREATE INDEX IF NOT EXISTS ix_trucks_search_vector ON trucks USING gin (search_vector);
+
+CREATE INDEX IF NOT EXISTS ix_trucks_name_trgm ON trucks USING gin (name gin_trgm_ops);
@@ -0,0 +1,7 @@
+-- Row version for trucks: set by the app on every write to a truck or its
+-- reviews, and used to key cached page fragments.
+--
+-- Applied by:  flask --app app migrate
+
+ALTER TABLE trucks
+    ADD COLUMN IF NOT EXISTS updated_at timestamp with time zone NOT NULL DEFAULT now();
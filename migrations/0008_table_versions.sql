@@ -0,0 +1,13 @@
+-- Version counter per table, bumped by the app on writes that change its
+-- list pages (models.TableVersion); the truck list's conditional GET reads the
+-- 'trucks' row instead of aggregating over the trucks table.
+--
+-- Applied by:  flask --app app migrate
+
+CREATE TABLE IF NOT EXISTS table_versions (
+    name text PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0
+);
+
+INSERT INTO table_versions (name, version) VALUES ('trucks', 0)
+    ON CONFLICT (name) DO NOTHING;
@@ -1,8 +1,17 @@
 """SQLAlchemy models for Food Locator App."""
 
+import os
+from datetime import datetime, timezone
+
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from flask_bcrypt import Bcrypt
-import requests
+from sqlalchemy import func, case, event, inspect, select, update, DDL
+from sqlalchemy.orm import aliased, contains_eager
+from sqlalchemy.sql import ColumnElement
+
+import geocoding
+import passwords
 
 bcrypt = Bcrypt()
 db = SQLAlchemy()
@@ -16,6 +25,31 @@ def connect_db(app):
         db.init_app(app)
 
 
+def utcnow():
+    """Return the current time (UTC, microsecond resolution) for row versions."""
+
+    return datetime.now(timezone.utc)
+
+
+def keyset_page(query, column, after=None, per_page=20, descending=True):
+    """Return (rows, next_key) for one page of query ordered by unique column.
+
+    `after` is the previous page's next_key: rows continue strictly past it
+    (WHERE column < after for descending order), so each page costs one
+    index range scan however deep it is.  next_key is None on the last page.
+    """
+
+    if after is not None:
+        query = query.filter(column < after if descending else column > after)
+
+    rows = query.order_by(column.desc() if descending else column).limit(per_page + 1).all()
+
+    if len(rows) > per_page:
+        return rows[:per_page], getattr(rows[per_page - 1], column.key)
+
+    return rows, None
+
+
 class Review(db.Model):
     """ User reviews about truck. """
 
@@ -36,8 +70,10 @@ class Review(db.Model):
                         nullable=False
                         )
     
-    rating = db.Column(db.Float,
-                       nullable=False)
+    # active history: an edit must know the old rating to move the truck aggregates
+    rating = db.column_property(db.Column(db.Float,
+                                          nullable=False),
+                                active_history=True)
     
     review = db.Column(db.Text,
                        nullable=False)
@@ -46,6 +82,34 @@ class Review(db.Model):
     image_2 = db.Column(db.Text)
     image_3 = db.Column(db.Text)
     image_4 = db.Column(db.Text)
+
+
+    @classmethod
+    def truck_page(cls, truck_id, before=None, per_page=20, options=()):
+        """Return (reviews, next_key): a truck's reviews newest first, older than review id `before`.
+
+        `options` are loader options (e.g. joinedload) for what the caller will render.
+        """
+
+        query = cls.query.options(*options).filter(cls.truck_id == truck_id)
+
+        return keyset_page(query, cls.id, before, per_page)
+
+    @classmethod
+    def user_page(cls, user_id, before=None, per_page=20, options=()):
+        """Return (reviews, next_key): a user's reviews newest first, older than review id `before`.
+
+        `options` are loader options (e.g. joinedload) for what the caller will render.
+        """
+
+        query = cls.query.options(*options).filter(cls.user_id == user_id)
+
+        return keyset_page(query, cls.id, before, per_page)
+
+
+# latest reviews of a truck / of a user: WHERE x_id = ? ORDER BY id DESC LIMIT n
+db.Index("ix_reviews_truck_id_id", Review.truck_id, Review.id.desc())
+db.Index("ix_reviews_user_id_id", Review.user_id, Review.id.desc())
     
 
 class Truck(db.Model):
@@ -53,6 +117,10 @@ class Truck(db.Model):
 
     __tablename__ = "trucks"
 
+    # bounding-box prefilter for "trucks near me"; owner's trucks (user.trucks)
+    __table_args__ = (db.Index("ix_trucks_latitude_longitude", "latitude", "longitude"),
+                      db.Index("ix_trucks_user_id", "user_id"))
+
     id = db.Column(db.Integer,
                    primary_key=True,
                    autoincrement=True
@@ -94,9 +162,11 @@ class Truck(db.Model):
     location = db.Column(db.Text,
                          default="Closed")
 
-    latitude = db.Column(db.String)        
+    latitude = db.Column(db.Float)
 
-    longitude = db.Column(db.String)       
+    longitude = db.Column(db.Float)
+
+    place_name = db.Column(db.Text)         # reverse-geocoded name stored with the coordinates
 
     social_media_1 = db.Column(db.Text)
 
@@ -107,22 +177,506 @@ class Truck(db.Model):
     # category_id = db.Column(db.Integer,
     #                         db.ForeignKey('categories.id', ondelete="cascade")
     #                         )
-    
+
+    # Rating aggregates, kept current on review writes (see adjust_ratings)
+    review_count = db.Column(db.Integer,
+                             nullable=False,
+                             default=0,
+                             server_default="0")
+
+    rating_sum = db.Column(db.Float,
+                           nullable=False,
+                           default=0,
+                           server_default="0")
+
+    # histogram: number of reviews rated N to N.5 stars
+    stars_0 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    stars_1 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    stars_2 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    stars_3 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    stars_4 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    stars_5 = db.Column(db.Integer, nullable=False, default=0, server_default="0")
+    
+    # row version: bumped by every write to the truck or its reviews (fragment cache key)
+    updated_at = db.Column(db.DateTime(timezone=True),
+                           nullable=False,
+                           default=utcnow,
+                           onupdate=utcnow,
+                           server_default=func.now())
+
     reviews = db.relationship('Review', backref="trucks")
 
+    @property
+    def average_rating(self):
+        """Return the mean review rating, or None if there are no reviews."""
+
+        if not self.review_count:
+            return None
+
+        return self.rating_sum / self.review_count
+
+    @property
+    def rating_histogram(self):
+        """Return [(stars, count)] from 5 stars down to 0."""
+
+        return [(stars, getattr(self, f"stars_{stars}")) for stars in range(5, -1, -1)]
+
+    @staticmethod
+    def star_column(rating):
+        """Return the histogram column name for a rating (0 - 5, in halves)."""
+
+        return f"stars_{min(int(rating), 5)}"
+
+    def adjust_ratings(self, added=None, removed=None):
+        """Update rating aggregates for a review rating being added and/or removed.
+
+        Saved trucks get SQL increments (`SET review_count = review_count + 1`)
+        so concurrent reviews can't overwrite each other's counts; several
+        reviews in one flush add onto the same pending increment.
+        """
+
+        deltas = {}
+
+        for rating, sign in ((added, 1), (removed, -1)):
+            if rating is None:
+                continue
+
+            for column, delta in (("review_count", sign),
+                                  ("rating_sum", sign * float(rating)),
+                                  (self.star_column(rating), sign)):
+                deltas[column] = deltas.get(column, 0) + delta
+
+        pending = inspect(self).pending or inspect(self).transient
+
+        for column, delta in deltas.items():
+            if not delta:
+                continue
+            if pending:
+                setattr(self, column, (getattr(self, column) or 0) + delta)
+            else:
+                current = self.__dict__.get(column)
+                base = current if isinstance(current, ColumnElement) else getattr(Truck, column)
+                setattr(self, column, base + delta)
+
+    @classmethod
+    def reconcile_ratings(cls):
+        """Recompute every truck's rating aggregates from the reviews table.
+
+        Returns the number of trucks whose stored aggregates were wrong.
+        """
+
+        stars = case((Review.rating >= 5, 5), else_=db.cast(Review.rating, db.Integer))
+        aggregates = {row.truck_id: row for row in
+                      db.session.query(Review.truck_id,
+                                       func.count(Review.id).label("review_count"),
+                                       func.sum(Review.rating).label("rating_sum"),
+                                       *(func.count(case((stars == n, 1))).label(f"stars_{n}") for n in range(6)))
+                      .group_by(Review.truck_id)}
+
+        fixed = 0
+
+        for truck in cls.query.all():
+            row = aggregates.get(truck.id)
+            correct = {"review_count": row.review_count if row else 0,
+                       "rating_sum": float(row.rating_sum) if row else 0.0,
+                       **{f"stars_{n}": getattr(row, f"stars_{n}") if row else 0 for n in range(6)}}
+
+            if any(getattr(truck, column) != value for column, value in correct.items()):
+                fixed += 1
+                for column, value in correct.items():
+                    setattr(truck, column, value)
+
+        return fixed
+
+    @classmethod
+    def detail(cls, truck_id, n_reviews=4):
+        """Return (truck, latest reviews with authors) in one query, or None if no such truck.
+
+        The truck row is outer-joined to a LIMIT n_reviews derived table of its
+        newest reviews (an ix_reviews_truck_id_id range scan) and their
+        authors, so the detail page costs one round trip however many
+        reviews the truck has.  Rating and count come from the truck's
+        denormalized aggregates.
+        """
+
+        latest = (db.session
+                  .query(Review)
+                  .filter(Review.truck_id == truck_id)
+                  .order_by(Review.id.desc())
+                  .limit(n_reviews)
+                  .subquery())
+        review = aliased(Review, latest)
+
+        rows = (db.session
+                .query(cls, review)
+                .outerjoin(review, review.truck_id == cls.id)
+                .outerjoin(review.users)
+                .options(contains_eager(review.users).load_only(User.id, User.first_name, User.last_name))
+                .filter(cls.id == truck_id)
+                .order_by(review.id.desc())
+                .all())
+
+        if not rows:
+            return None
+
+        return rows[0][0], [review for truck, review in rows if review is not None]
+
+    @classmethod
+    def page_version(cls, truck_id, n_reviews=4, before=None):
+        """Return (updated_at, authors) for a truck page showing its newest `n_reviews`
+        reviews older than review id `before`, or None if no such truck.
+
+        `authors` are the (id, first name, last name) of those reviews'
+        authors, whose names the page shows but whose edits don't touch the
+        truck.  One query shaped like detail(), for conditional GETs.
+        """
+
+        latest = (db.session
+                  .query(Review.id, Review.truck_id, Review.user_id)
+                  .filter(Review.truck_id == truck_id))
+
+        if before is not None:
+            latest = latest.filter(Review.id < before)
+
+        latest = latest.order_by(Review.id.desc()).limit(n_reviews).subquery()
+
+        rows = (db.session
+                .query(cls.updated_at, User.id, User.first_name, User.last_name)
+                .outerjoin(latest, latest.c.truck_id == cls.id)
+                .outerjoin(User, User.id == latest.c.user_id)
+                .filter(cls.id == truck_id)
+                .order_by(latest.c.id.desc())
+                .all())
+
+        if not rows:
+            return None
+
+        return rows[0].updated_at, tuple(tuple(row[1:]) for row in rows if row.id is not None)
+
+    @classmethod
+    def summary_query(cls):
+        """Return a query of truck summary rows.
+
+        Each row carries the truck columns used by the listing pages plus
+        `average_rating` and `review_count`, read from the denormalized
+        rating aggregates rather than computed over reviews.
+        """
+
+        return (db.session
+                .query(cls.id,
+                       cls.name,
+                       cls.logo_image,
+                       cls.location,
+                       cls.latitude,
+                       cls.longitude,
+                       cls.place_name,
+                       cls.open_time,
+                       cls.close_time,
+                       cls.phone_number,
+                       cls.updated_at,
+                       (cls.rating_sum / func.nullif(cls.review_count, 0)).label("average_rating"),
+                       cls.review_count))
+
+    @classmethod
+    def summaries(cls):
+        """Return summary rows for all trucks."""
+
+        return cls.summary_query().order_by(cls.id).all()
+
+    @classmethod
+    def search(cls, q=None, after=None, per_page=24):
+        """Return (summary rows, next_key) for one page of trucks matching q, best match first.
+
+        On Postgres, q is matched against name, bio and location/place name
+        with full-text search (stemmed words, "quoted phrases", -exclusions)
+        plus trigram word similarity on the name, so typos and partial
+        words still find a truck; both are served by GIN indexes.  Other
+        databases fall back to case-insensitive substring matching.
+        Without q, every truck is listed in id order.
+
+        Pass the previous page's next_key as `after` to continue.  The plain
+        listing pages by keyset on id; ranked results page by offset (the
+        key is then a row count), since rank isn't a stable unique column.
+        """
+
+        query = cls.summary_query()
+
+        if not q:
+            return keyset_page(query, cls.id, after, per_page, descending=False)
+
+        if db.engine.dialect.name == "postgresql":
+            tsquery = func.websearch_to_tsquery("english", q)
+            search_vector = db.literal_column("trucks.search_vector")
+
+            query = (query
+                     .filter(db.or_(search_vector.op("@@")(tsquery),
+                                    db.literal(q).op("<%")(cls.name)))
+                     .order_by((func.ts_rank_cd(search_vector, tsquery) + func.word_similarity(q, cls.name)).desc(),
+                               cls.id))
+
+        else:
+            in_name = cls.name.icontains(q, autoescape=True)
+
+            query = (query
+                     .filter(db.or_(in_name,
+                                    cls.bio.icontains(q, autoescape=True),
+                                    cls.location.icontains(q, autoescape=True),
+                                    cls.place_name.icontains(q, autoescape=True)))
+                     .order_by(case((in_name, 0), else_=1), cls.id))
+
+        offset = max(after or 0, 0)
+
+        # one extra row tells us whether there's a next page
+        rows = query.offset(offset).limit(per_page + 1).all()
+
+        return rows[:per_page], offset + per_page if len(rows) > per_page else None
+
+    @classmethod
+    def in_bbox(cls, min_lng, min_lat, max_lng, max_lat):
+        """Return summary rows for trucks inside a lng/lat bounding box.
+
+        A box with min_lng > max_lng is taken to cross the antimeridian.
+        """
+
+        return (cls.summary_query()
+                .filter(cls.latitude.between(min_lat, max_lat), cls.longitude_between(min_lng, max_lng))
+                .order_by(cls.id)
+                .all())
+
+    @classmethod
+    def longitude_between(cls, min_lng, max_lng):
+        """Return a filter on longitude; min_lng > max_lng is a range crossing the antimeridian."""
+
+        if min_lng <= max_lng:
+            return cls.longitude.between(min_lng, max_lng)
+
+        return db.or_(cls.longitude >= min_lng, cls.longitude <= max_lng)
+
+    @classmethod
+    def nearby(cls, lat, lng, radius, limit=50):
+        """Return [(distance, summary row)] for trucks within `radius` miles
+        of (lat, lng), closest first.
+
+        A bounding box on the indexed latitude/longitude columns narrows the
+        candidates in SQL; exact haversine distances are computed for those.
+        """
+
+        min_lat, max_lat, min_lng, max_lng = geocoding.bounding_box(lat, lng, radius)
+
+        candidates = (cls.summary_query()
+                      .filter(cls.latitude.between(min_lat, max_lat),
+                              cls.longitude_between(min_lng, max_lng))
+                      .all())
+
+        results = []
+        for truck in candidates:
+            distance = geocoding.haversine(lat, lng, truck.latitude, truck.longitude)
+            if distance <= radius:
+                results.append((distance, truck))
+
+        results.sort(key=lambda result: result[0])
+
+        return results[:limit]
+
     @classmethod
     def request_coords(cls, API_BASE, key, location):
-        """Return {lat, lng} from MapBox API for given location"""
+        """Return {lat, lng, place_name} from MapBox API for given location,
+        or None if MapBox has no match.
+
+        Coordinates are normalized (rounded to 6 decimal places, ~10 cm) so
+        they can be stored as-is.  Uses the permanent geocoding endpoint since
+        results are persisted on the truck.  Answers (including "no match")
+        are cached by normalized address.
+
+        Raises geocoding.GeocodingError if MapBox can't be reached.
+        """
+
+        cache_key = geocoding.normalize_address(location)
+        cached = geocoding.cache.get(cache_key)
+
+        if cached is not geocoding.MISS:
+            return cached
+
+        url = f"{API_BASE}.places-permanent/{location}.json?access_token={key}"
+
+        r = geocoding.client.get_json(url)
+
+        if r.get('features'):
+            feature = r['features'][0]
+            lng = round(feature['geometry']['coordinates'][0], 6)
+            lat = round(feature['geometry']['coordinates'][1], 6)
+            coords = {"lat": lat, "lng": lng, "place_name": feature.get('place_name')}
+        else:
+            coords = None
+
+        geocoding.cache.set(cache_key, coords)
+        return coords
+
+    @classmethod
+    def request_place_name(cls, API_BASE, key, lng, lat):
+        """Return the reverse-geocoded place name from MapBox API for given coordinates."""
+
+        cache_key = f"reverse:{lng},{lat}"
+        cached = geocoding.cache.get(cache_key)
+
+        if cached is not geocoding.MISS:
+            return cached and cached["place_name"]
+
+        url = f"{API_BASE}.places-permanent/{lng},{lat}.json?access_token={key}"
+
+        r = geocoding.client.get_json(url)
+
+        if r.get('features'):
+            place = {"lat": float(lat), "lng": float(lng), "place_name": r['features'][0]['place_name']}
+        else:
+            place = None
+
+        geocoding.cache.set(cache_key, place)
+        return place and place["place_name"]
+
+    def update_location(self, API_BASE, key, location):
+        """Geocode `location` and store it with its coordinates and place name on this truck.
+
+        Returns False (leaving the truck unchanged) if the location can't be found.
+        """
+
+        if location:
+            coords = self.request_coords(API_BASE, key, location)
+
+            if coords is None:
+                return False
+
+            self.latitude = coords["lat"]
+            self.longitude = coords["lng"]
+            self.place_name = coords["place_name"]
+
+        self.location = location
+        return True
+
+
+# Postgres search support (see Truck.search): a generated, weighted tsvector
+# over name/bio/location and a trigram index on name.  Kept in step with
+# migrations/0006_truck_search.sql for existing databases.
+
+TRUCK_SEARCH_VECTOR = """
+    setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+    setweight(to_tsvector('english', coalesce(bio, '')), 'B') ||
+    setweight(to_tsvector('english', coalesce(place_name, '') || ' ' || coalesce(location, '')), 'C')
+"""
+
+event.listen(Truck.__table__, "before_create",
+             DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(dialect="postgresql"))
+
+for statement in (f"ALTER TABLE trucks ADD COLUMN search_vector tsvector "
+                  f"GENERATED ALWAYS AS ({TRUCK_SEARCH_VECTOR}) STORED",
+                  "CREATE INDEX ix_trucks_search_vector ON trucks USING gin (search_vector)",
+                  "CREATE INDEX ix_trucks_name_trgm ON trucks USING gin (name gin_trgm_ops)"):
+    event.listen(Truck.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+
+
+def review_truck(session, review):
+    """Return the Truck a review in this session belongs to (saved or pending)."""
+
+    truck = review.__dict__.get("trucks")
+
+    if truck is None:
+        truck = next((obj for obj in session.new
+                      if isinstance(obj, Truck) and obj.id == review.truck_id), None)
+
+    if truck is None and review.truck_id is not None:
+        truck = session.get(Truck, review.truck_id)
+
+    return truck
+
+
+@event.listens_for(db.session, "before_flush")
+def update_truck_ratings(session, flush_context, instances):
+    """Keep Truck rating aggregates and updated_at in step with reviews written in this flush."""
+
+    # (invalid reviews - no truck or rating - are left for the database to reject)
+
+    for review in session.new:
+        if isinstance(review, Review):
+            truck = review_truck(session, review)
+            if truck is not None:
+                truck.adjust_ratings(added=review.rating)
+
+    for review in session.deleted:
+        if isinstance(review, Review):
+            truck = review_truck(session, review)
+            if truck is not None and truck not in session.deleted:
+                truck.adjust_ratings(removed=review.rating)
+
+    for review in session.dirty:
+        if isinstance(review, Review):
+            history = inspect(review).attrs.rating.history
+            truck = review_truck(session, review)
+            if truck is None or not session.is_modified(review):
+                continue
+            if history.added and history.deleted:
+                truck.adjust_ratings(added=history.added[0], removed=history.deleted[0])
+            else:
+                # text/images only: still a new version of the truck page
+                truck.updated_at = utcnow()
+
+
+class TableVersion(db.Model):
+    """Counter bumped by writes that change a table's list pages: a one-row validator for them."""
+
+    __tablename__ = "table_versions"
+
+    name = db.Column(db.Text, primary_key=True)
+    version = db.Column(db.BigInteger, nullable=False, default=0, server_default="0")
+
+    @classmethod
+    def current(cls, name):
+        """Return the table's version (0 if it has no row yet)."""
+
+        return db.session.query(cls.version).filter_by(name=name).scalar() or 0
 
-        url = f"{API_BASE}.places/{location}.json?access_token={key}"
 
-        response = requests.get(url)
-        r = response.json()
+event.listen(TableVersion.__table__, "after_create",
+             DDL("INSERT INTO table_versions (name, version) VALUES ('trucks', 0)"))
 
-        lng = r['features'][0]['geometry']['coordinates'][0]
-        lat = r['features'][0]['geometry']['coordinates'][1]
 
-        return {"lat": lat, "lng": lng}
+# what the truck list and its search read; rating aggregate writes (every review) don't touch these
+LISTED_TRUCK_COLUMNS = ("name", "logo_image", "bio", "location", "place_name")
+
+
+@event.listens_for(Truck, "after_insert")
+@event.listens_for(Truck, "after_delete")
+def bump_trucks_version(mapper, connection, truck):
+    table = TableVersion.__table__
+    connection.execute(update(table).where(table.c.name == "trucks").values(version=table.c.version + 1))
+
+
+@event.listens_for(Truck, "after_update")
+def bump_trucks_version_if_listed(mapper, connection, truck):
+    attrs = inspect(truck).attrs
+
+    if any(attrs[column].history.has_changes() for column in LISTED_TRUCK_COLUMNS):
+        bump_trucks_version(mapper, connection, truck)
+
+
+_dummy_hashes = {}
+
+
+def log_rounds():
+    """Return the app's bcrypt cost factor (BCRYPT_LOG_ROUNDS), used for new hashes and rehash checks."""
+
+    return current_app.config.get('BCRYPT_LOG_ROUNDS', 12)
+
+
+def dummy_password_hash():
+    """Return a hash of a random password at the current cost factor (for unknown usernames)."""
+
+    rounds = log_rounds()
+
+    if rounds not in _dummy_hashes:
+        _dummy_hashes[rounds] = passwords.pool.run(bcrypt.generate_password_hash,
+                                                   os.urandom(16).hex(), rounds).decode('UTF-8')
+
+    return _dummy_hashes[rounds]
 
 
 class User(db.Model):
@@ -176,6 +730,25 @@ class User(db.Model):
 
         return f"{self.first_name} {self.last_name}"
 
+    @property
+    def favorite_ids(self):
+        """Return frozenset of favorited truck ids (one narrow query; no Truck rows loaded)."""
+
+        rows = db.session.query(Favorite.truck_id).filter(Favorite.user_id == self.id)
+
+        return frozenset(truck_id for (truck_id,) in rows)
+
+    def recent_favorites(self, limit=3):
+        """Return the user's last `limit` favorited trucks, newest first."""
+
+        return (Truck
+                .query
+                .join(Favorite, Favorite.truck_id == Truck.id)
+                .filter(Favorite.user_id == self.id)
+                .order_by(Favorite.id.desc())
+                .limit(limit)
+                .all())
+
 
     @classmethod
     def signup(cls, username, email, first_name, last_name, password, profile_image, role):
@@ -185,14 +758,12 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
-
         user = User(
             username=username,
             email=email,
             first_name=first_name,
             last_name=last_name,
-            password=hashed_pwd,
+            password=cls.hash_password(password),
             profile_image=profile_image,
             role=role
         )
@@ -214,21 +785,42 @@ class User(db.Model):
 
         user = cls.query.filter_by(username=username).first()
 
-        if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
-            if is_auth:
-                return user
+        if user is None:
+            # same bcrypt cost as a real check: timing doesn't reveal unknown usernames
+            passwords.pool.run(bcrypt.check_password_hash, dummy_password_hash(), password)
+            return False
+
+        if user.check_password(password):
+            return user
 
         return False
 
-    @classmethod
-    def update_password(cls, username, new_password):
-        """Updates user's password to new_password."""
+    @staticmethod
+    def hash_password(password):
+        """Return a bcrypt hash of password (computed on the password pool)."""
 
-        user = cls.query.filter_by(username=username).first()
+        return passwords.pool.run(bcrypt.generate_password_hash, password, log_rounds()).decode('UTF-8')
+
+    def check_password(self, password):
+        """Return True if password is the user's password (checked on the password pool).
 
-        new_hashed_password = bcrypt.generate_password_hash(new_password).decode('UTF-8')
-        user.password = new_hashed_password
+        A hash made with a different cost factor than BCRYPT_LOG_ROUNDS is
+        replaced with a current one on success, so the work factor can be
+        tuned without password resets; the caller commits.
+        """
+
+        if not passwords.pool.run(bcrypt.check_password_hash, self.password, password):
+            return False
+
+        if passwords.cost(self.password) != log_rounds():
+            self.set_password(password)
+
+        return True
+
+    def set_password(self, new_password):
+        """Replace the user's password with new_password (the caller commits)."""
+
+        self.password = self.hash_password(new_password)
 
 
 class Favorite(db.Model):
@@ -248,6 +840,67 @@ class Favorite(db.Model):
     truck_id = db.Column(db.Integer,
                         db.ForeignKey('trucks.id', ondelete="cascade")
                         )
+
+    # one row per (user, truck); also serves user.favorites and "is this truck
+    # favorited?" lookups.  truck_id alone: cascades when a truck is deleted.
+    __table_args__ = (db.Index("ix_favorites_user_id_truck_id", "user_id", "truck_id", unique=True),
+                      db.Index("ix_favorites_truck_id", "truck_id"))
+
+
+    @classmethod
+    def add(cls, user_id, truck_id):
+        """Favorite truck for user.  Return True if it wasn't already a favorite."""
+
+        if db.engine.dialect.name == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+
+        stmt = (insert(cls.__table__)
+                .values(user_id=user_id, truck_id=truck_id)
+                .on_conflict_do_nothing(index_elements=["user_id", "truck_id"]))
+
+        return db.session.execute(stmt).rowcount == 1
+
+    @classmethod
+    def remove(cls, user_id, truck_id):
+        """Unfavorite truck for user.  Return True if it was a favorite."""
+
+        stmt = cls.__table__.delete().where(cls.user_id == user_id, cls.truck_id == truck_id)
+
+        return db.session.execute(stmt).rowcount > 0
+
+    @classmethod
+    def toggle(cls, user_id, truck_id):
+        """Flip truck's favorite state for user without loading their favorites.
+
+        Returns the new state: True if now a favorite, False if removed.
+        """
+
+        if cls.remove(user_id, truck_id):
+            return False
+
+        # (a concurrent toggle may have inserted it first: still a favorite)
+        cls.add(user_id, truck_id)
+        return True
+
+
+# profile header badges: COUNT(*) subqueries served by ix_reviews_user_id_id and
+# ix_favorites_user_id_truck_id.  Deferred; load with undefer(User.review_count).
+User.review_count = db.column_property(select(func.count())
+                                       .select_from(Review)
+                                       .where(Review.user_id == User.id)
+                                       .correlate_except(Review)
+                                       .scalar_subquery(),
+                                       deferred=True)
+
+User.favorite_count = db.column_property(select(func.count())
+                                         .select_from(Favorite)
+                                         .where(Favorite.user_id == User.id)
+                                         .correlate_except(Favorite)
+                                         .scalar_subquery(),
+                                         deferred=True)
+
         
 ################################################################      
 # Future Considerations:
@@ -0,0 +1,92 @@
+"""Bounded worker pool for password hashing in Food Locator App.
+
+bcrypt is slow on purpose (~250 ms per hash or check at cost 12) and CPU
+bound.  Run on the request thread, a burst of logins ties up every
+worker until the burst is over.  Password work is instead run on `pool`:
+a fixed number of threads (the bcrypt extension releases the GIL while
+hashing, so they run in parallel) with a bounded queue.  When the queue
+is full, new work is refused at once with PasswordPoolBusy, which the app
+answers with 503 + Retry-After, so admitted logins finish in predictable
+time instead of everyone waiting behind the burst.
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+DEFAULT_WORKERS = 2
+DEFAULT_MAX_QUEUE = 8
+DEFAULT_TIMEOUT = 5
+
+
+class PasswordPoolBusy(Exception):
+    """The password pool's queue is full (or the wait timed out); retry later."""
+
+
+class PasswordPool:
+    """Run password work on `workers` threads, with at most `max_queue` jobs waiting."""
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, timeout=DEFAULT_TIMEOUT):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="passwords")
+        self._lock = threading.Lock()
+
+    def run(self, fn, *args):
+        """Return fn(*args) computed on the pool.
+
+        Raises PasswordPoolBusy immediately if `workers + max_queue` jobs are
+        already running or queued, or if the result takes over `timeout` seconds.
+        """
+
+        with self._lock:
+            if self.in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise PasswordPoolBusy()
+            self.in_flight += 1
+
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(self._done)
+
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise PasswordPoolBusy() from None
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        return {"workers": self.workers, "max_queue": self.max_queue, "in_flight": self.in_flight,
+                "completed": self.completed, "rejected": self.rejected, "timeouts": self.timeouts}
+
+
+pool = PasswordPool()
+
+
+def configure_pool(workers=DEFAULT_WORKERS, max_queue=DEFAULT_MAX_QUEUE, timeout=DEFAULT_TIMEOUT):
+    """Replace the module pool."""
+
+    global pool
+
+    pool.shutdown()
+    pool = PasswordPool(workers=workers, max_queue=max_queue, timeout=timeout)
+
+    return pool
+
+
+def cost(pw_hash):
+    """Return the bcrypt cost factor (log rounds) a hash was made with, e.g. 12 for "$2b$12$..."."""
+
+    return int(pw_hash.split("$")[2])
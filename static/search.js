@@ -0,0 +1,43 @@
+// Navbar search type-ahead: debounced suggestions from /api/trucks/suggest
+
+const searchInput = document.querySelector("#search");
+const searchSuggestions = document.querySelector("#search-suggestions");
+
+let suggestTimer;
+let suggestRequest;
+
+async function showSuggestions() {
+    const prefix = searchInput.value.trim();
+
+    // a newer keystroke supersedes any request still in flight
+    if (suggestRequest) suggestRequest.abort();
+
+    if (!prefix) {
+        searchSuggestions.replaceChildren();
+        return;
+    }
+
+    suggestRequest = new AbortController();
+
+    try {
+        const resp = await fetch(`/api/trucks/suggest?prefix=${encodeURIComponent(prefix)}`,
+                                 {signal: suggestRequest.signal});
+        const {suggestions} = await resp.json();
+
+        searchSuggestions.replaceChildren(...suggestions.map((truck) => {
+            const option = document.createElement("option");
+            option.value = truck.name;
+            if (truck.location) option.label = truck.location;
+            return option;
+        }));
+    } catch (e) {
+        if (e.name !== "AbortError") throw e;
+    }
+}
+
+if (searchInput) {
+    searchInput.addEventListener("input", () => {
+        clearTimeout(suggestTimer);
+        suggestTimer = setTimeout(showSuggestions, 150);
+    });
+}
@@ -0,0 +1,127 @@
+"""In-memory type-ahead index of truck names and locations for Food Locator App.
+
+Every word of a truck's name and location (and the whole name) is kept
+as a lowercased key in one sorted list, so a prefix lookup is a bisect
+plus a short scan over the matching run.  Trucks are added, renamed and
+removed in place; like the cluster index, each worker's copy is also
+rebuilt from the database after `max_age` seconds to pick up other
+workers' writes.
+"""
+
+import bisect
+import re
+import threading
+import time
+
+NAME, NAME_WORD, LOCATION_WORD = 0, 1, 2      # match kinds, best first
+
+
+def words(text):
+    """Return the lowercased words of text."""
+
+    return re.findall(r"\w+", (text or "").lower())
+
+
+class PrefixIndex:
+    """Sorted (key, kind, truck id) entries searchable by key prefix."""
+
+    def __init__(self, max_age=60, clock=time.monotonic):
+        self.max_age = max_age
+        self.clock = clock
+        self.built_at = None
+        self.entries = []           # sorted [(key, kind, truck_id)]
+        self.trucks = {}            # truck_id -> (name, location, [entries], sort key)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def _entries(truck_id, name, location):
+        keys = {(" ".join(words(name)), NAME)}
+        keys.update((word, NAME_WORD) for word in words(name))
+        keys.update((word, LOCATION_WORD) for word in words(location))
+
+        return [(key, kind, truck_id) for key, kind in keys if key]
+
+    def add(self, truck_id, name, location=None):
+        """Add (or rename/move) a truck."""
+
+        with self._lock:
+            self.remove(truck_id)
+
+            entries = self._entries(truck_id, name, location)
+            for entry in entries:
+                bisect.insort(self.entries, entry)
+
+            self.trucks[truck_id] = (name, location, entries, (name or "").lower())
+
+    def remove(self, truck_id):
+        """Remove a truck if present."""
+
+        with self._lock:
+            truck = self.trucks.pop(truck_id, None)
+
+            if truck is None:
+                return
+
+            for entry in truck[2]:
+                i = bisect.bisect_left(self.entries, entry)
+                if i < len(self.entries) and self.entries[i] == entry:
+                    del self.entries[i]
+
+    def rebuild(self, trucks):
+        """Replace the index contents with `trucks`: iterable of (id, name, location)."""
+
+        with self._lock:
+            self.trucks = {}
+            entries = []
+
+            for truck_id, name, location in trucks:
+                truck_entries = self._entries(truck_id, name, location)
+                self.trucks[truck_id] = (name, location, truck_entries, (name or "").lower())
+                entries.extend(truck_entries)
+
+            entries.sort()
+            self.entries = entries
+            self.built_at = self.clock()
+
+    def invalidate(self):
+        """Force a rebuild on next use."""
+
+        self.built_at = None
+
+    @property
+    def stale(self):
+        return self.built_at is None or self.clock() - self.built_at > self.max_age
+
+    def suggest(self, prefix, limit=8, max_scan=500):
+        """Return up to `limit` [{id, name, location}] whose name or location has a
+        word starting with prefix; whole-name matches first, then name words,
+        then locations, alphabetically within each.
+
+        At most `max_scan` matching keys are looked at, which keeps one- and
+        two-letter prefixes fast on large indexes at the cost of exact ranking.
+        """
+
+        prefix = " ".join(words(prefix))
+        if not prefix:
+            return []
+
+        best = {}               # truck_id -> (kind, key)
+
+        with self._lock:
+            i = bisect.bisect_left(self.entries, (prefix,))
+
+            end = min(i + max_scan, len(self.entries))
+
+            while i < end and self.entries[i][0].startswith(prefix):
+                key, kind, truck_id = self.entries[i]
+                if truck_id not in best or (kind, key) < best[truck_id]:
+                    best[truck_id] = (kind, key)
+                i += 1
+
+            ranked = sorted(best, key=lambda truck_id: (best[truck_id][0], self.trucks[truck_id][3]))
+
+            return [{"id": truck_id, "name": self.trucks[truck_id][0], "location": self.trucks[truck_id][1]}
+                    for truck_id in ranked[:limit]]
+
+
+index = PrefixIndex()
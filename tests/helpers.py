@@ -0,0 +1,11 @@
+"""Helpers shared by the test modules."""
+
+
+class FakeClock:
+    """Clock that only moves when told to."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
@@ -0,0 +1,80 @@
+"""Map marker clustering tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_clustering.py
+
+from unittest import TestCase
+
+from clustering import ClusterIndex
+
+WORLD = (-180, -90, 180, 90)
+QUAD_CITIES = (-90.7, 41.4, -90.3, 41.7)
+
+# a few trucks around the Quad Cities and one in Chicago
+TRUCKS = [
+    (1, -90.50243, 41.552586, {"name": "Bettendorf"}),
+    (2, -90.577637, 41.523644, {"name": "Davenport"}),
+    (3, -90.515134, 41.506700, {"name": "Moline"}),
+    (4, -87.629798, 41.878114, {"name": "Chicago"}),
+]
+
+
+class ClusterIndexTestCase(TestCase):
+    """Test grid clustering per zoom level."""
+
+    def setUp(self):
+        self.index = ClusterIndex(max_zoom=14)
+        self.index.rebuild(TRUCKS)
+
+    def counts(self, features):
+        return sorted(feature["properties"].get("point_count", 1) for feature in features)
+
+    def test_low_zoom_clusters(self):
+        features = self.index.features(2, WORLD)
+
+        # whole fleet collapses to a single cluster at country scale
+        self.assertEqual(self.counts(features), [4])
+        self.assertTrue(features[0]["properties"]["cluster"])
+
+    def test_mid_zoom(self):
+        # Quad Cities trucks cluster together; Chicago stands alone
+        features = self.index.features(7, WORLD)
+
+        self.assertEqual(self.counts(features), [1, 3])
+
+    def test_high_zoom_individual_trucks(self):
+        features = self.index.features(16, QUAD_CITIES)
+
+        self.assertEqual(sorted(feature["id"] for feature in features), [1, 2, 3])
+        self.assertEqual(features[0]["properties"]["name"],
+                         {1: "Bettendorf", 2: "Davenport", 3: "Moline"}[features[0]["id"]])
+
+    def test_bbox_filter(self):
+        features = self.index.features(16, (-88, 41, -87, 42))
+
+        self.assertEqual([feature["id"] for feature in features], [4])
+
+    def test_incremental_update(self):
+        # Chicago truck drives to the Quad Cities
+        self.index.update(4, -90.55, 41.53, {"name": "Chicago"})
+        self.assertEqual(self.counts(self.index.features(7, WORLD)), [4])
+
+        # and closes (no coordinates)
+        self.index.update(4, None, None, {"name": "Chicago"})
+        self.assertEqual(self.counts(self.index.features(7, WORLD)), [3])
+        self.assertEqual(sum(len(grid) for grid in self.index.grids[:8]), 8)
+
+    def test_remove(self):
+        for truck_id, *rest in TRUCKS:
+            self.index.remove(truck_id)
+
+        self.assertEqual(self.index.features(2, WORLD), [])
+        self.assertTrue(all(not grid for grid in self.index.grids))
+
+    def test_stale(self):
+        index = ClusterIndex(max_age=60, clock=lambda: 0)
+        self.assertTrue(index.stale)
+
+        index.rebuild([])
+        self.assertFalse(index.stale)
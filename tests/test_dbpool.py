@@ -0,0 +1,71 @@
+"""Connection pool tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_dbpool.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, exc
+
+from dbpool import MeteredQueuePool, engine_options, stats
+
+
+class MeteredQueuePoolTestCase(TestCase):
+    """Test pool checkout counters."""
+
+    def setUp(self):
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'pool.db')}"
+        self.engine = create_engine(url, **engine_options(url, pool_size=1, max_overflow=0, pool_timeout=0.05))
+        self.addCleanup(self.engine.dispose)
+
+    def test_checkouts(self):
+        for i in range(3):
+            self.engine.connect().close()
+
+        pool_stats = stats(self.engine)
+        self.assertEqual((pool_stats["checkouts"], pool_stats["checked_out"], pool_stats["idle"]), (3, 0, 1))
+
+    def test_timeout(self):
+        held = self.engine.connect()
+
+        with self.assertRaises(exc.TimeoutError):
+            self.engine.connect()
+
+        pool_stats = stats(self.engine)
+        self.assertEqual((pool_stats["timeouts"], pool_stats["checked_out"]), (1, 1))
+        self.assertGreaterEqual(pool_stats["wait_ms_max"], 50)
+
+        held.close()
+
+    def test_dispose_keeps_metering(self):
+        self.engine.connect().close()
+        self.engine.dispose()
+
+        self.assertIsInstance(self.engine.pool, MeteredQueuePool)
+        self.assertEqual(stats(self.engine)["checkouts"], 0)
+
+
+class EngineOptionsTestCase(TestCase):
+    """Test engine options built from settings."""
+
+    timeouts = {"statement_timeout": 5000, "lock_timeout": 2000}
+
+    def test_postgres_timeouts_at_connect(self):
+        options = engine_options("postgresql:///food_truck", pool_size=4, max_overflow=2, timeouts=self.timeouts)
+
+        self.assertEqual((options["pool_size"], options["max_overflow"]), (4, 2))
+        self.assertTrue(options["pool_pre_ping"])
+        self.assertEqual(options["connect_args"]["options"], "-c statement_timeout=5000 -c lock_timeout=2000")
+
+    def test_pgbouncer(self):
+        options = engine_options("postgresql://pgbouncer:6432/food_truck", timeouts=self.timeouts, pgbouncer=True)
+        self.assertNotIn("connect_args", options)
+
+        options = engine_options("postgresql+psycopg://pgbouncer:6432/food_truck", pgbouncer=True)
+        self.assertEqual(options["connect_args"], {"prepare_threshold": None})
+
+    def test_sqlite_memory(self):
+        self.assertNotIn("poolclass", engine_options("sqlite://", pool_size=4))
@@ -0,0 +1,81 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_fragments.py
+
+from unittest import TestCase
+
+from jinja2 import Environment
+
+import fragments
+from fragments import FragmentCache, FragmentCacheExtension
+
+CARD = '{% cache "truck-card", truck.id, truck.version %}<b>{{ truck.name }}</b>{% endcache %} {{ star }}'
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test FragmentCache bookkeeping."""
+
+    def test_get_set_and_stats(self):
+        cache = FragmentCache()
+
+        self.assertIsNone(cache.get(("truck-card", 1, "v1")))
+        cache.set(("truck-card", 1, "v1"), "<b>One</b>")
+        self.assertEqual(cache.get(("truck-card", 1, "v1")), "<b>One</b>")
+
+        stats = cache.stats()
+        self.assertEqual((stats["size"], stats["bytes"], stats["hits"], stats["misses"]), (1, 10, 1, 1))
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_invalidate_truck(self):
+        cache = FragmentCache()
+        cache.set(("truck-card", 1, "v1"), "one")
+        cache.set(("truck-body", 1, "v1"), "body")
+        cache.set(("truck-card", 2, "v1"), "two")
+
+        cache.invalidate_truck(1)
+
+        self.assertIsNone(cache.get(("truck-card", 1, "v1")))
+        self.assertIsNone(cache.get(("truck-body", 1, "v1")))
+        self.assertEqual(cache.get(("truck-card", 2, "v1")), "two")
+        self.assertEqual(cache.stats()["bytes"], 3)
+        self.assertEqual(cache.stats()["invalidations"], 2)
+
+    def test_bounded_by_count_and_bytes(self):
+        cache = FragmentCache(maxsize=2, max_bytes=10)
+        cache.set(("truck-card", 1, "v1"), "aaaa")
+        cache.set(("truck-card", 2, "v1"), "bbbb")
+        cache.get(("truck-card", 1, "v1"))              # 1 is now most recently used
+        cache.set(("truck-card", 3, "v1"), "cccc")
+
+        self.assertIsNone(cache.get(("truck-card", 2, "v1")))
+        self.assertEqual(cache.get(("truck-card", 1, "v1")), "aaaa")
+
+        cache.set(("truck-card", 4, "v1"), "dddddddd")   # over max_bytes: evict down to fit
+        self.assertEqual(cache.stats()["size"], 1)
+        self.assertEqual(cache.stats()["bytes"], 8)
+
+
+class FragmentCacheExtensionTestCase(TestCase):
+    """Test the {% cache %} template tag."""
+
+    def setUp(self):
+        original = fragments.cache
+        self.addCleanup(setattr, fragments, "cache", original)
+        self.cache = fragments.cache = FragmentCache()
+        self.template = Environment(extensions=[FragmentCacheExtension], autoescape=True).from_string(CARD)
+
+    def render(self, name, version, star):
+        truck = {"id": 1, "name": name, "version": version}
+        return self.template.render(truck=truck, star=star)
+
+    def test_cached_by_version(self):
+        self.assertEqual(self.render("Taco <Truck>", "v1", "*"), "<b>Taco &lt;Truck&gt;</b> *")
+
+        # same version: served from cache; the per-user part outside the block still renders
+        self.assertEqual(self.render("ignored", "v1", "-"), "<b>Taco &lt;Truck&gt;</b> -")
+        self.assertEqual(self.cache.stats()["hits"], 1)
+
+        # new version re-renders
+        self.assertEqual(self.render("Taco Barn", "v2", "*"), "<b>Taco Barn</b> *")
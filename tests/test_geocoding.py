@@ -0,0 +1,269 @@
+"""Geocoding client and cache tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_geocoding.py
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase
+
+from geocoding import (MISS, MemoryGeocodeCache, DatabaseGeocodeCache,
+                       TieredGeocodeCache, normalize_address, haversine, bounding_box,
+                       MapboxClient, GeocodingError, CircuitOpenError)
+from tests.helpers import FakeClock
+
+COORDS = {"lat": 41.552586, "lng": -90.50243, "place_name": "2900 Learning Campus Drive, Bettendorf, Iowa"}
+
+
+class NormalizeAddressTestCase(TestCase):
+    """Test cache key normalization."""
+
+    def test_normalize_address(self):
+        self.assertEqual(normalize_address("  2900 Learning Campus Dr ,Bettendorf,  IA 52722. "),
+                         "2900 learning campus dr, bettendorf, ia 52722")
+        self.assertEqual(normalize_address("2900 LEARNING CAMPUS DR, BETTENDORF, IA 52722"),
+                         normalize_address("2900 Learning Campus Dr,  Bettendorf, IA 52722"))
+
+
+class DistanceTestCase(TestCase):
+    """Test haversine distance and bounding boxes."""
+
+    def test_haversine(self):
+        # Bettendorf, IA -> Chicago, IL is about 151 miles
+        distance = haversine(41.552586, -90.50243, 41.878114, -87.629798)
+        self.assertAlmostEqual(distance, 151, delta=2)
+        self.assertEqual(haversine(41.5, -90.5, 41.5, -90.5), 0)
+
+    def test_bounding_box_contains_circle(self):
+        min_lat, max_lat, min_lng, max_lng = bounding_box(41.5, -90.5, 10)
+
+        self.assertAlmostEqual(haversine(41.5, -90.5, max_lat, -90.5), 10, places=3)
+        self.assertGreaterEqual(haversine(41.5, -90.5, 41.5, max_lng), 10)
+        self.assertLess(min_lng, -90.5)
+
+    def test_bounding_box_across_antimeridian(self):
+        min_lat, max_lat, min_lng, max_lng = bounding_box(0, 179.95, 20)
+
+        self.assertGreater(min_lng, max_lng)
+        self.assertLess(min_lng, 179.95)
+        self.assertGreater(max_lng, -180)
+
+    def test_bounding_box_near_pole(self):
+        self.assertEqual(bounding_box(89.99, 0, 50)[2:], (-180.0, 180.0))
+
+
+class MemoryGeocodeCacheTestCase(TestCase):
+    """Test in-process LRU/TTL cache."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = MemoryGeocodeCache(maxsize=2, ttl=100, negative_ttl=10, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        self.assertIs(self.cache.get("a"), MISS)
+        self.cache.set("a", COORDS)
+        self.assertEqual(self.cache.get("a"), COORDS)
+
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["hit_ratio"], 0.5)
+
+    def test_negative_caching(self):
+        self.cache.set("nowhere", None)
+        self.assertIsNone(self.cache.get("nowhere"))
+
+        # "no result" answers expire sooner than real ones
+        self.clock.now += 11
+        self.assertIs(self.cache.get("nowhere"), MISS)
+
+    def test_ttl_expiry(self):
+        self.cache.set("a", COORDS)
+        self.clock.now += 101
+
+        self.assertIs(self.cache.get("a"), MISS)
+        self.assertEqual(self.cache.stats()["expirations"], 1)
+
+    def test_lru_eviction(self):
+        self.cache.set("a", COORDS)
+        self.cache.set("b", COORDS)
+
+        # touch "a" so "b" is least recently used
+        self.cache.get("a")
+        self.cache.set("c", COORDS)
+
+        self.assertIs(self.cache.get("b"), MISS)
+        self.assertEqual(self.cache.get("a"), COORDS)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+        self.assertEqual(self.cache.stats()["size"], 2)
+
+
+class DatabaseGeocodeCacheTestCase(TestCase):
+    """Test table-backed cache (in-memory SQLite)."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = DatabaseGeocodeCache("sqlite://", ttl=100, negative_ttl=10, clock=self.clock)
+
+    def test_set_get(self):
+        self.assertIs(self.cache.get("a"), MISS)
+
+        self.cache.set("a", COORDS)
+        self.assertEqual(self.cache.get("a"), COORDS)
+
+        # overwriting an existing key is an upsert
+        self.cache.set("a", None)
+        self.assertIsNone(self.cache.get("a"))
+
+    def test_ttl_expiry(self):
+        self.cache.set("a", COORDS)
+        self.clock.now += 101
+
+        self.assertIs(self.cache.get("a"), MISS)
+
+
+class TieredGeocodeCacheTestCase(TestCase):
+    """Test memory cache in front of a database cache."""
+
+    def test_fills_faster_tier(self):
+        memory = MemoryGeocodeCache()
+        database = DatabaseGeocodeCache("sqlite://")
+        cache = TieredGeocodeCache(memory, database)
+
+        database.set("a", COORDS)
+
+        self.assertEqual(cache.get("a"), COORDS)
+        self.assertEqual(memory.get("a"), COORDS)
+        self.assertIs(cache.get("b"), MISS)
+
+    def test_faster_tier_keeps_expiry(self):
+        """Does a filled memory entry expire with the database entry, not a fresh TTL later?"""
+
+        clock = FakeClock()
+        memory = MemoryGeocodeCache(ttl=100, negative_ttl=10, clock=clock)
+        database = DatabaseGeocodeCache("sqlite://", ttl=100, negative_ttl=10, clock=clock)
+        cache = TieredGeocodeCache(memory, database)
+
+        database.set("a", COORDS)
+        database.set("nowhere", None)
+        clock.now += 8
+
+        self.assertEqual(cache.get("a"), COORDS)
+        self.assertIsNone(cache.get("nowhere"))
+
+        clock.now += 3
+        self.assertIs(memory.get("nowhere"), MISS)
+        self.assertEqual(memory.get("a"), COORDS)
+
+        clock.now += 90
+        self.assertIs(memory.get("a"), MISS)
+
+
+class StandInMapbox(BaseHTTPRequestHandler):
+    """Local stand-in for MapBox: replies with the server's queued (status, body, delay)."""
+
+    protocol_version = "HTTP/1.1"      # keep-alive, like the real API
+
+    def do_GET(self):
+        status, body, delay = self.server.replies.pop(0) if self.server.replies else (200, {}, 0)
+        self.server.hits += 1
+        self.server.ports.add(self.client_address[1])
+
+        time.sleep(delay)
+        payload = json.dumps(body).encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class MapboxClientTestCase(TestCase):
+    """Test MapboxClient against a local HTTP server."""
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInMapbox)
+        self.server.replies = []
+        self.server.hits = 0
+        self.server.ports = set()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        self.url = f"http://127.0.0.1:{self.server.server_port}/geocode.json"
+        self.client = MapboxClient(read_timeout=0.5, max_retries=2, backoff=0.01,
+                                   failure_threshold=2, reset_timeout=60)
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_get_json(self):
+        self.server.replies = [(200, {"features": []}, 0)]
+
+        self.assertEqual(self.client.get_json(self.url), {"features": []})
+
+    def test_keep_alive(self):
+        """Repeat requests reuse one pooled connection."""
+
+        for i in range(3):
+            self.client.get_json(self.url)
+
+        self.assertEqual(self.server.hits, 3)
+        self.assertEqual(len(self.server.ports), 1)
+
+    def test_retries_server_errors(self):
+        self.server.replies = [(503, {}, 0), (500, {}, 0), (200, {"ok": True}, 0)]
+
+        self.assertEqual(self.client.get_json(self.url), {"ok": True})
+        self.assertEqual(self.client.stats()["retries"], 2)
+
+    def test_no_retry_on_client_error(self):
+        self.server.replies = [(401, {}, 0), (200, {}, 0)]
+
+        with self.assertRaises(GeocodingError):
+            self.client.get_json(self.url)
+
+        self.assertEqual(self.server.hits, 1)
+
+    def test_read_timeout(self):
+        self.server.replies = [(200, {}, 1)] * 3
+
+        start = time.monotonic()
+        with self.assertRaises(GeocodingError):
+            self.client.get_json(self.url)
+
+        # three attempts at ~0.5s each, never the full server delay
+        self.assertLess(time.monotonic() - start, 2.5)
+
+    def test_circuit_breaker(self):
+        self.server.replies = [(500, {}, 0)] * 6
+
+        for i in range(2):
+            with self.assertRaises(GeocodingError):
+                self.client.get_json(self.url)
+
+        hits = self.server.hits
+        self.assertEqual(self.client.stats()["circuit"], "open")
+
+        # fails fast without touching the server
+        with self.assertRaises(CircuitOpenError):
+            self.client.get_json(self.url)
+
+        self.assertEqual(self.server.hits, hits)
+        self.assertEqual(self.client.stats()["rejected"], 1)
+
+    def test_circuit_half_open(self):
+        self.client.breaker.reset_timeout = 0
+        self.client.breaker.record_failure()
+        self.client.breaker.record_failure()
+        self.server.replies = [(200, {"ok": True}, 0)]
+
+        self.assertEqual(self.client.get_json(self.url), {"ok": True})
+        self.assertEqual(self.client.stats()["circuit"], "closed")
@@ -0,0 +1,71 @@
+"""Migration runner tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_migrate.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import create_engine, inspect
+
+import migrate
+
+
+class MigrateTestCase(TestCase):
+    """Test applying versioned SQL migrations (SQLite)."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.directory, 'test.db')}")
+
+        self.write("0001_create_things.sql", "CREATE TABLE things (id integer primary key, name text);")
+        self.write("0002_index_things.sql", "CREATE INDEX ix_things_name ON things (name);")
+        self.write("README.txt", "not a migration")
+
+    def tearDown(self):
+        self.engine.dispose()
+
+    def write(self, filename, sql):
+        with open(os.path.join(self.directory, filename), "w") as f:
+            f.write(sql)
+
+    def test_migration_files(self):
+        self.assertEqual(migrate.migration_files(self.directory),
+                         [("0001", "0001_create_things.sql"), ("0002", "0002_index_things.sql")])
+
+    def test_migrate_applies_pending_once(self):
+        applied = migrate.migrate(self.engine, self.directory, echo=lambda message: None)
+
+        self.assertEqual(applied, ["0001_create_things.sql", "0002_index_things.sql"])
+        self.assertEqual(migrate.applied_versions(self.engine), {"0001", "0002"})
+        self.assertIn("ix_things_name", [ix["name"] for ix in inspect(self.engine).get_indexes("things")])
+
+        # nothing left to do; a new file is picked up on the next run
+        self.assertEqual(migrate.migrate(self.engine, self.directory, echo=lambda message: None), [])
+
+        self.write("0003_add_things_color.sql", "ALTER TABLE things ADD COLUMN color text;")
+        self.assertEqual(migrate.pending(self.engine, self.directory), [("0003", "0003_add_things_color.sql")])
+
+    def test_no_transaction_migration(self):
+        """Files marked no-transaction run statement by statement."""
+
+        self.write("0003_more_indexes.sql", f"""{migrate.NO_TRANSACTION}
+
+CREATE INDEX ix_things_id_name ON things (id, name);
+
+CREATE INDEX ix_things_name_id ON things (name, id);
+""")
+
+        migrate.migrate(self.engine, self.directory, echo=lambda message: None)
+
+        indexes = {ix["name"] for ix in inspect(self.engine).get_indexes("things")}
+        self.assertTrue({"ix_things_id_name", "ix_things_name_id"} <= indexes)
+
+    def test_mark_applied(self):
+        self.assertEqual(migrate.mark_applied(self.engine, "0001", self.directory), ["0001_create_things.sql"])
+        self.assertEqual(migrate.pending(self.engine, self.directory), [("0002", "0002_index_things.sql")])
+
+        # 0001 was recorded, not run
+        self.assertFalse(inspect(self.engine).has_table("things"))
@@ -0,0 +1,60 @@
+"""Password pool tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_passwords.py
+
+import threading
+import time
+from unittest import TestCase
+
+from passwords import PasswordPool, PasswordPoolBusy, cost
+
+
+class PasswordPoolTestCase(TestCase):
+    """Test PasswordPool admission and shedding."""
+
+    def setUp(self):
+        self.pool = PasswordPool(workers=1, max_queue=1, timeout=5)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_run(self):
+        self.assertEqual(self.pool.run(pow, 2, 10), 1024)
+        self.assertEqual(self.pool.stats()["completed"], 1)
+        self.assertEqual(self.pool.stats()["in_flight"], 0)
+
+    def test_sheds_when_full(self):
+        release = threading.Event()
+        callers = [threading.Thread(target=self.pool.run, args=(release.wait,)) for i in range(2)]
+
+        for caller in callers:
+            caller.start()
+
+        # one running, one queued: the next is refused without waiting
+        while self.pool.stats()["in_flight"] < 2:
+            time.sleep(0.001)
+
+        with self.assertRaises(PasswordPoolBusy):
+            self.pool.run(pow, 2, 10)
+
+        release.set()
+        for caller in callers:
+            caller.join()
+
+        self.assertEqual(self.pool.stats()["rejected"], 1)
+        self.assertEqual(self.pool.run(pow, 2, 10), 1024)
+
+    def test_timeout(self):
+        pool = PasswordPool(workers=1, max_queue=0, timeout=0.01)
+        self.addCleanup(pool.shutdown)
+        release = threading.Event()
+
+        with self.assertRaises(PasswordPoolBusy):
+            pool.run(release.wait)
+
+        release.set()
+        self.assertEqual(pool.stats()["timeouts"], 1)
+
+    def test_cost(self):
+        self.assertEqual(cost("$2b$12$KIXQJ1sT1b7sSGrmB0kLneY7b8uX8vYc3yU4mF3p2XqZ1b2c3d4e5"), 12)
+        self.assertEqual(cost("$2b$04$abcdefghijklmnopqrstuu"), 4)
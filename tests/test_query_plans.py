@@ -0,0 +1,142 @@
+"""Query plan tests: hot routes' queries use their indexes."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python3 -m unittest tests/test_query_plans.py
+
+import os
+from contextlib import contextmanager
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, Truck, User, Review, Favorite
+import identity
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///food_truck_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+# one app context for the whole module (the app doesn't push one itself)
+app.app_context().push()
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.testing = True
+
+
+@contextmanager
+def capture_queries():
+    """Collect (statement, parameters) for every SQL statement run inside the block."""
+
+    queries = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        queries.append((statement, parameters))
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield queries
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+
+def explain(statement, parameters):
+    """Return the database's plan for statement as text.
+
+    Postgres is told to avoid sequential scans: on test-sized tables it would
+    pick them anyway, and the question here is whether an index *can* serve
+    the query.
+    """
+
+    with db.engine.connect() as conn:
+        if db.engine.dialect.name == "postgresql":
+            conn.exec_driver_sql("SET enable_seqscan = off")
+            rows = conn.exec_driver_sql(f"EXPLAIN {statement}", parameters)
+        else:
+            rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+
+        return "\n".join(str(row) for row in rows)
+
+
+class QueryPlanTestCase(TestCase):
+    """Check the plans of each hot route's queries."""
+
+    def setUp(self):
+        User.query.delete()
+        Truck.query.delete()
+        identity.cache.clear()
+
+        self.client = app.test_client()
+
+        owner = User.signup("planowner", "planowner@email.com", "Plan", "Owner", "password", None, "business")
+        fan = User.signup("planfan", "planfan@email.com", "Plan", "Fan", "password", None, "personal")
+        db.session.flush()
+
+        truck = Truck(user_id=owner.id,
+                      name="Plan Truck",
+                      email="plantruck@email.com",
+                      menu_image="https://img.freepik.com/free-vector/blank-menu_1308-31027.jpg",
+                      phone_number="563-555-0101")
+        db.session.add(truck)
+        db.session.flush()
+
+        db.session.add(Review(user_id=fan.id, truck_id=truck.id, rating=4.0, review="A sample review."))
+        db.session.add(Favorite(user_id=fan.id, truck_id=truck.id))
+        db.session.commit()
+
+        self.owner_id, self.fan_id, self.truck_id = owner.id, fan.id, truck.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def route_plans(self, path, user_id, *fragments):
+        """GET path as user_id; return plans of the queries whose SQL contains every fragment."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            with capture_queries() as queries:
+                resp = c.get(path)
+
+        self.assertEqual(resp.status_code, 200)
+
+        plans = [explain(statement, parameters) for statement, parameters in queries
+                 if all(fragment in statement for fragment in fragments)]
+        self.assertTrue(plans, f"no query on {path} matching {fragments}")
+
+        return plans
+
+    def assertUsesIndex(self, plans, index):
+        for plan in plans:
+            self.assertIn(index, plan)
+
+    def test_truck_show_latest_reviews(self):
+        plans = self.route_plans(f"/trucks/{self.truck_id}", self.fan_id, "FROM reviews", "reviews.truck_id")
+        self.assertUsesIndex(plans, "ix_reviews_truck_id_id")
+
+    def test_truck_list_reviews(self):
+        plans = self.route_plans(f"/trucks/{self.truck_id}/reviews", self.fan_id, "FROM reviews", "reviews.truck_id")
+        self.assertUsesIndex(plans, "ix_reviews_truck_id_id")
+
+    def test_users_show_reviews(self):
+        plans = self.route_plans(f"/users/{self.fan_id}/reviews", self.fan_id, "FROM reviews", "reviews.user_id")
+        self.assertUsesIndex(plans, "ix_reviews_user_id_id")
+
+    def test_users_show_favorites(self):
+        plans = self.route_plans(f"/users/{self.fan_id}/favorites", self.fan_id, "JOIN favorites", "users_1.id IN")
+        self.assertUsesIndex(plans, "ix_favorites_user_id_truck_id")
+
+    def test_user_trucks(self):
+        plans = self.route_plans(f"/users/{self.owner_id}", self.owner_id, "FROM trucks", "trucks.user_id IN")
+        self.assertUsesIndex(plans, "ix_trucks_user_id")
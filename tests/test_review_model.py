@@ -21,6 +21,9 @@ os.environ['DATABASE_URL'] = "postgresql:///food_truck_test"
 
 from app import app
 
+# one app context for the whole module (the app doesn't push one itself)
+app.app_context().push()
+
 class ReviewModelTestCase(TestCase):
     """Test review model."""
 
@@ -258,4 +261,89 @@ class ReviewModelTestCase(TestCase):
         db.session.add(r_test)
         
         with self.assertRaises(exc.IntegrityError) as context:
-            db.session.commit()
\ No newline at end of file
+            db.session.commit()
+
+    def test_rating_aggregates(self):
+        """Are truck rating aggregates kept current as reviews are added, edited and deleted?"""
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(truck.review_count, 1)
+        self.assertEqual(truck.average_rating, 4.5)
+        self.assertEqual(truck.stars_4, 1)
+
+        r2 = Review(user_id = self.uid1,
+                    truck_id = self.tid1,
+                    rating = 2.0,
+                    review = "A second sample review about food trucks."
+                    )
+        db.session.add(r2)
+        db.session.commit()
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(truck.review_count, 2)
+        self.assertEqual(truck.average_rating, 3.25)
+        self.assertEqual(dict(truck.rating_histogram), {5: 0, 4: 1, 3: 0, 2: 1, 1: 0, 0: 0})
+
+        # edit moves the rating between histogram buckets
+        r2.rating = 5.0
+        db.session.commit()
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(truck.review_count, 2)
+        self.assertEqual(truck.rating_sum, 9.5)
+        self.assertEqual((truck.stars_2, truck.stars_5), (0, 1))
+
+        db.session.delete(r2)
+        db.session.commit()
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(truck.review_count, 1)
+        self.assertEqual(truck.rating_sum, 4.5)
+        self.assertEqual(truck.stars_5, 0)
+
+    def test_rating_aggregates_batch(self):
+        """Do several reviews of one saved truck in a single commit all count?"""
+
+        r2 = Review(user_id = self.uid1, truck_id = self.tid1, rating = 4.0, review = "Second review.")
+        r3 = Review(user_id = self.uid1, truck_id = self.tid1, rating = 2.0, review = "Third review.")
+        db.session.add_all([r2, r3])
+        db.session.commit()
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(truck.review_count, 3)
+        self.assertEqual(truck.rating_sum, 10.5)
+        self.assertEqual((truck.stars_2, truck.stars_4), (1, 2))
+
+        r2.rating = 5.0
+        r3.rating = 1.0
+        db.session.commit()
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(truck.rating_sum, 10.5)
+        self.assertEqual((truck.stars_1, truck.stars_2, truck.stars_4, truck.stars_5), (1, 0, 1, 1))
+
+        db.session.delete(r2)
+        db.session.delete(r3)
+        db.session.commit()
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(truck.review_count, 1)
+        self.assertEqual(truck.rating_sum, 4.5)
+        self.assertEqual((truck.stars_1, truck.stars_5), (0, 0))
+
+    def test_reconcile_ratings(self):
+        """Does reconcile_ratings repair drifted aggregates?"""
+
+        truck = Truck.query.get(self.tid1)
+        truck.review_count = 7
+        truck.stars_0 = 3
+        db.session.commit()
+
+        self.assertEqual(Truck.reconcile_ratings(), 1)
+        db.session.commit()
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(truck.review_count, 1)
+        self.assertEqual(truck.rating_sum, 4.5)
+        self.assertEqual((truck.stars_0, truck.stars_4), (0, 1))
+        self.assertEqual(Truck.reconcile_ratings(), 0)
@@ -0,0 +1,80 @@
+"""Startup (import time) tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_startup.py
+
+import os
+import re
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Cold-start budget for `import app` (cumulative, per `python -X importtime`).
+# It measures about 0.3 s on a laptop; the budget leaves room for slow CI.
+IMPORT_BUDGET_US = 1_500_000
+
+# Imported on first use, not at startup (secrets2 only when the
+# environment doesn't provide the secrets).
+DEFERRED_MODULES = ("requests", "forms", "wtforms", "secrets2")
+
+
+def run_python(code, db_path, *options, **env):
+    """Run `code` in a fresh interpreter with the app pointed at a SQLite file."""
+
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{db_path}", SECRET_KEY="startup-test", **env)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [ROOT, env.get("PYTHONPATH")]))
+
+    return subprocess.run([sys.executable, *options, "-c", code],
+                          cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+
+
+class StartupTestCase(TestCase):
+    """Test that importing the app is cheap and does no I/O."""
+
+    @classmethod
+    def setUpClass(cls):
+        tmp = tempfile.mkdtemp()
+        cls.db_paths = [os.path.join(tmp, name) for name in ("startup.db", "geocode.db", "throttle.db")]
+
+        code = f"import app, sys; print(' '.join(m for m in {DEFERRED_MODULES!r} if m in sys.modules))"
+        result = run_python(code, cls.db_paths[0], "-X", "importtime",
+                            GEOCODE_CACHE_URL=f"sqlite:///{cls.db_paths[1]}",
+                            LOGIN_THROTTLE_URL=f"sqlite:///{cls.db_paths[2]}",
+                            ACCESS_TOKEN="startup-test", API_SECRET_KEY="startup-test")
+
+        cls.loaded = result.stdout.split()
+        cls.import_times = {line.split("|")[2].strip(): int(line.split("|")[1])
+                            for line in result.stderr.splitlines()
+                            if re.match(r"import time:\s+\d", line)}
+
+    def test_import_budget(self):
+        self.assertLess(self.import_times["app"], IMPORT_BUDGET_US)
+
+    def test_heavy_imports_deferred(self):
+        self.assertEqual(self.loaded, [])
+
+    def test_no_database_io(self):
+        for db_path in self.db_paths:
+            self.assertFalse(os.path.exists(db_path))
+
+
+class AfterForkTestCase(TestCase):
+    """Test that a preloaded app's workers drop inherited connections."""
+
+    def test_after_fork_discards_pooled_connections(self):
+        code = "\n".join([
+            "from app import app, after_fork",
+            "from models import db",
+            "with app.app_context():",
+            "    db.engine.connect().close()",
+            "    before = db.engine.pool.checkedin()",
+            "    after_fork(app)",
+            "    print(before, db.engine.pool.checkedin())"])
+
+        result = run_python(code, os.path.join(tempfile.mkdtemp(), "fork.db"))
+
+        self.assertEqual(result.stdout.split(), ["1", "0"])
@@ -0,0 +1,63 @@
+"""Type-ahead prefix index tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_suggest.py
+
+import time
+from unittest import TestCase
+
+from suggest import PrefixIndex
+
+TRUCKS = [
+    (1, "Taco Truck", "2900 Learning Campus Drive, Bettendorf, Iowa"),
+    (2, "Tasty Tacos", "Davenport, Iowa"),
+    (3, "Pizza Pals", "Taylor Ridge, Illinois"),
+    (4, "Burger Barn", None),
+]
+
+
+class PrefixIndexTestCase(TestCase):
+    """Test PrefixIndex lookups and incremental updates."""
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        self.index.rebuild(TRUCKS)
+
+    def names(self, prefix, **kwargs):
+        return [truck["name"] for truck in self.index.suggest(prefix, **kwargs)]
+
+    def test_suggest_ranking(self):
+        # whole-name match, then name-word match, then location match
+        self.assertEqual(self.names("ta"), ["Taco Truck", "Tasty Tacos", "Pizza Pals"])
+        self.assertEqual(self.names("TACO"), ["Taco Truck", "Tasty Tacos"])
+
+    def test_suggest_multiword_and_limit(self):
+        self.assertEqual(self.names("taco tr"), ["Taco Truck"])
+        self.assertEqual(self.names("ta", limit=1), ["Taco Truck"])
+        self.assertEqual(self.names("  "), [])
+        self.assertEqual(self.names("zz"), [])
+
+    def test_suggest_location(self):
+        self.assertEqual(self.index.suggest("bettend"),
+                         [{"id": 1, "name": "Taco Truck", "location": "2900 Learning Campus Drive, Bettendorf, Iowa"}])
+
+    def test_rename_and_remove(self):
+        self.index.add(4, "Taco Barn")
+        self.assertIn("Taco Barn", self.names("taco"))
+        self.assertEqual(self.names("burger"), [])
+
+        self.index.remove(1)
+        self.assertEqual(self.names("taco"), ["Taco Barn", "Tasty Tacos"])
+        self.assertEqual(self.names("bettendorf"), [])
+
+    def test_suggest_is_fast(self):
+        index = PrefixIndex()
+        index.rebuild((i, f"Truck {i} Grill", f"{i} Main Street, Davenport, Iowa") for i in range(100000))
+
+        start = time.perf_counter()
+        for i in range(100):
+            index.suggest("truck 42")
+        elapsed = (time.perf_counter() - start) / 100
+
+        self.assertLess(elapsed, 0.001)
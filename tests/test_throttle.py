@@ -0,0 +1,96 @@
+"""Login throttle tests."""
+
+# run these tests like:
+#
+#    python3 -m unittest tests/test_throttle.py
+
+import os
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import select
+
+from throttle import MemoryRateLimiter, DatabaseRateLimiter, LoginThrottle
+from tests.helpers import FakeClock
+
+
+class MemoryRateLimiterTestCase(TestCase):
+    """Test the in-process sliding window."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.limiter = self.make_limiter(limit=3, window=60)
+
+    def make_limiter(self, limit, window):
+        return MemoryRateLimiter(limit, window, clock=self.clock)
+
+    def test_sliding_window(self):
+        for i in range(3):
+            self.assertEqual(self.limiter.hit("a"), 0)
+            self.clock.now += 10
+
+        # 4th within the window is refused until the 1st slides out
+        self.assertEqual(self.limiter.hit("a"), 30)
+        self.assertEqual(self.limiter.hit("b"), 0)
+
+        self.clock.now += 30
+        self.assertEqual(self.limiter.hit("a"), 0)
+        self.assertGreater(self.limiter.hit("a"), 0)
+
+    def test_reset(self):
+        for i in range(3):
+            self.limiter.hit("a")
+
+        self.limiter.reset("a")
+        self.assertEqual(self.limiter.hit("a"), 0)
+
+    def test_stats(self):
+        for i in range(4):
+            self.limiter.hit("a")
+
+        stats = self.limiter.stats()
+        self.assertEqual((stats["allowed"], stats["rejected"]), (3, 1))
+
+
+class DatabaseRateLimiterTestCase(MemoryRateLimiterTestCase):
+    """Test the shared (SQLite) sliding window."""
+
+    def make_limiter(self, limit, window):
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'throttle.db')}"
+        return DatabaseRateLimiter(url, limit, window, clock=self.clock)
+
+    def test_purges_expired_keys(self):
+        """Are expired attempts of keys that are never hit again deleted too?"""
+
+        self.limiter.hit("a")
+        self.clock.now += 61
+        self.limiter.hit("b")
+
+        with self.limiter.engine.connect() as conn:
+            keys = [key for (key,) in conn.execute(select(self.limiter.table.c.key))]
+
+        self.assertEqual(keys, ["b"])
+
+
+class LoginThrottleTestCase(TestCase):
+    """Test per-username and per-address limits together."""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.throttle = LoginThrottle(MemoryRateLimiter(2, 60, clock=self.clock),
+                                      MemoryRateLimiter(3, 60, clock=self.clock))
+
+    def test_per_user(self):
+        self.assertEqual(self.throttle.attempt("Alice", "10.0.0.1"), 0)
+        self.assertEqual(self.throttle.attempt(" alice", "10.0.0.2"), 0)
+        self.assertGreater(self.throttle.attempt("ALICE", "10.0.0.3"), 0)
+
+        self.throttle.succeeded("alice")
+        self.assertEqual(self.throttle.attempt("alice", "10.0.0.4"), 0)
+
+    def test_per_ip(self):
+        for username in ("a", "b", "c"):
+            self.assertEqual(self.throttle.attempt(username, "10.0.0.1"), 0)
+
+        self.assertGreater(self.throttle.attempt("d", "10.0.0.1"), 0)
+        self.assertEqual(self.throttle.attempt("d", "10.0.0.2"), 0)
@@ -6,9 +6,11 @@
 
 import os
 from unittest import TestCase
+from unittest.mock import patch
 from sqlalchemy import exc
 
 from models import db, User, Truck, Favorite
+import geocoding
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -19,7 +21,12 @@ os.environ['DATABASE_URL'] = "postgresql:///food_truck_test"
 
 # Now we can import app
 
-from app import app, GEOCODE_API_BASE_URL, KEY
+from app import app, GEOCODE_API_BASE_URL
+
+# one app context for the whole module (the app doesn't push one itself)
+app.app_context().push()
+
+KEY = app.config['API_SECRET_KEY']
 
 class TruckModelTestCase(TestCase):
     """Test truck model."""
@@ -322,6 +329,20 @@ class TruckModelTestCase(TestCase):
         self.assertEqual(len(f), 1)
         self.assertEqual(f[0].truck_id, test_truck.id)
 
+        # adding again is a no-op; toggling removes then re-adds
+        self.assertFalse(Favorite.add(uidpersonal, test_truck.id))
+        self.assertFalse(Favorite.toggle(uidpersonal, test_truck.id))
+        self.assertEqual(Favorite.query.filter(Favorite.user_id == uidpersonal).count(), 0)
+        self.assertTrue(Favorite.toggle(uidpersonal, test_truck.id))
+        db.session.commit()
+
+        self.assertEqual(u_personal.favorite_ids, {test_truck.id})
+
+        # the unique index rejects duplicates added through the ORM too
+        db.session.add(Favorite(user_id=uidpersonal, truck_id=test_truck.id))
+        with self.assertRaises(exc.IntegrityError):
+            db.session.commit()
+
 ####
 #
 # Request Coords Test
@@ -362,5 +383,40 @@ class TruckModelTestCase(TestCase):
 
         truck_test = Truck.query.get(tid)
       
-        self.assertEqual(truck_test.latitude, "41.55241")
-        self.assertEqual(truck_test.longitude, "-90.50253")
+        self.assertEqual(truck_test.latitude, 41.55241)
+        self.assertEqual(truck_test.longitude, -90.50253)
+
+    def test_update_location(self):
+        """Does update_location store normalized coordinates and the place name?"""
+
+        mapbox_response = {"features": [{"geometry": {"coordinates": [-90.502430123, 41.5525861234]},
+                                         "place_name": "2900 Learning Campus Drive, Bettendorf, Iowa 52722, United States"}]}
+
+        geocoding.cache.clear()
+
+        with patch("geocoding.client") as mock_client:
+            mock_client.get_json.return_value = mapbox_response
+            self.assertTrue(self.t1.update_location(GEOCODE_API_BASE_URL, KEY, "2900 Learning Campus Dr, Bettendorf, IA 52722"))
+
+        db.session.commit()
+
+        truck = Truck.query.get(self.tid1)
+        self.assertEqual(mock_client.get_json.call_count, 1)
+        self.assertEqual(truck.latitude, 41.552586)
+        self.assertEqual(truck.longitude, -90.50243)
+        self.assertEqual(truck.place_name, "2900 Learning Campus Drive, Bettendorf, Iowa 52722, United States")
+
+    def test_request_coords_cached(self):
+        """Are repeat lookups (including "no result") served from the cache?"""
+
+        geocoding.cache.clear()
+
+        with patch("geocoding.client") as mock_client:
+            mock_client.get_json.return_value = {"features": []}
+
+            self.assertIsNone(Truck.request_coords(GEOCODE_API_BASE_URL, KEY, "Nowhere Lot"))
+            self.assertIsNone(Truck.request_coords(GEOCODE_API_BASE_URL, KEY, " nowhere  lot "))
+            self.assertFalse(self.t1.update_location(GEOCODE_API_BASE_URL, KEY, "NOWHERE LOT"))
+
+        self.assertEqual(mock_client.get_json.call_count, 1)
+        self.assertNotEqual(self.t1.location, "NOWHERE LOT")
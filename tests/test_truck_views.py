@@ -5,9 +5,17 @@
 #    FLASK_ENV=production python3 -m unittest tests/test_truck_views.py
 
 import os
+from contextlib import contextmanager
 from unittest import TestCase
+from unittest.mock import patch
+
+from sqlalchemy import event, exc
 
 from models import db, Truck, User, Review
+import clustering
+import suggest
+import identity
+import fragments
 from bs4 import BeautifulSoup
 
 # BEFORE we import our app, let's set an environmental variable
@@ -19,7 +27,10 @@ os.environ['DATABASE_URL'] = "postgresql:///food_truck_test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, update_truck_suggestions
+
+# one app context for the whole module (the app doesn't push one itself)
+app.app_context().push()
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -32,6 +43,26 @@ db.create_all()
 
 app.config['WTF_CSRF_ENABLED'] = False
 
+# Fail any view whose template lazy-loads a relationship (N+1 queries)
+
+app.config['RAISE_ON_LAZY_LOAD'] = True
+
+
+@contextmanager
+def count_queries():
+    """Collect every SQL statement sent to the database inside the block."""
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
 
 class TruckViewTestCase(TestCase):
     """Test views for trucks."""
@@ -41,6 +72,8 @@ class TruckViewTestCase(TestCase):
 
         User.query.delete()
         Truck.query.delete()
+        identity.cache.clear()
+        fragments.cache.clear()
 
         self.client = app.test_client()
 
@@ -300,6 +333,88 @@ class TruckViewTestCase(TestCase):
             self.assertNotIn("Different Foods", str(resp.data))
             self.assertNotIn("Odd Foods", str(resp.data))
 
+    def test_search_trucks_bio_case_insensitive(self):
+        self.truck3.bio = "Wood-fired pizza and calzones."
+        self.setup_trucks()
+
+        with self.client as c:
+            resp = c.get("/trucks", query_string={"q" : "PIZZA"})
+
+            self.assertIn("Different Foods", str(resp.data))
+            self.assertNotIn("Odd Foods", str(resp.data))
+
+    def test_trucks_pagination(self):
+        """Does /trucks page through trucks with a "More trucks" cursor?"""
+
+        self.setup_trucks()
+        ids = sorted([self.truck1_id, self.truck2_id, self.truck3_id, self.truck4_id])
+
+        trucks, next_key = Truck.search(None, per_page=3)
+        self.assertEqual([truck.id for truck in trucks], ids[:3])
+        self.assertEqual(next_key, ids[2])
+
+        trucks, next_key = Truck.search(None, after=next_key, per_page=3)
+        self.assertEqual([truck.id for truck in trucks], ids[3:])
+        self.assertIsNone(next_key)
+
+        with self.client as c:
+            resp = c.get("/trucks", query_string={"cursor": "not a cursor!"})
+            self.assertEqual(resp.status_code, 400)
+
+    def test_truck_reviews_pagination(self):
+        """Do truck reviews page newest first with "Older reviews" cursors?"""
+
+        self.setup_trucks()
+        db.session.add_all([Review(user_id=self.u1_id, truck_id=self.truck1_id, rating=3.0,
+                                   review=f"Paged review number {i}.")
+                            for i in range(25)])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/trucks/{self.truck1_id}/reviews")
+            self.assertEqual(resp.status_code, 200)
+
+            html = str(resp.data)
+            self.assertIn("Paged review number 24.", html)
+            self.assertNotIn("Paged review number 4.", html)
+            self.assertIn("Older reviews", html)
+
+            soup = BeautifulSoup(resp.data, 'html.parser')
+            more = soup.find("nav", {"class": "load-more"}).find("a")["href"]
+
+            resp = c.get(more)
+            html = str(resp.data)
+            self.assertIn("Paged review number 4.", html)
+            self.assertIn("Paged review number 0.", html)
+            self.assertNotIn("Paged review number 24.", html)
+            self.assertNotIn("Older reviews", html)
+
+    def test_trucks_suggest(self):
+        self.setup_trucks()
+        suggest.index.invalidate()
+
+        with self.client as c:
+            resp = c.get("/api/trucks/suggest", query_string={"prefix": "tes"})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([truck["name"] for truck in resp.json["suggestions"]],
+                             ["Testing Truck1", "Testing Truck2"])
+
+            # registering/renaming a truck updates the index in place
+            truck = Truck.query.get(self.truck4_id)
+            truck.name = "Testy Tacos"
+            db.session.commit()
+            update_truck_suggestions(truck)
+
+            resp = c.get("/api/trucks/suggest", query_string={"prefix": "tes", "limit": 1})
+            self.assertEqual(resp.json["suggestions"], [{"id": self.truck1_id, "name": "Testing Truck1", "location": None}])
+
+            resp = c.get("/api/trucks/suggest", query_string={"prefix": "testy"})
+            self.assertEqual([truck["name"] for truck in resp.json["suggestions"]], ["Testy Tacos"])
+
     def test_trucks_index(self):
         self.setup_trucks()
 
@@ -311,6 +426,144 @@ class TruckViewTestCase(TestCase):
             self.assertIn("Different Foods", str(resp.data))
             self.assertIn("Odd Foods", str(resp.data))
 
+    def test_trucks_index_query_count(self):
+        """Truck listing should cost a version check plus one query no matter how many trucks/reviews exist."""
+
+        self.setup_trucks()
+        self.setup_reviews()
+        db.session.commit()
+
+        with self.client as c:
+            with count_queries() as statements:
+                resp = c.get("/trucks")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(statements), 2)
+
+    def test_homepage_query_count(self):
+        """Homepage should load the current user plus one truck summary query."""
+
+        self.setup_trucks()
+        self.setup_reviews()
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            with patch("geocoding.client") as mock_client:
+                with count_queries() as statements:
+                    resp = c.get("/")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Testing Truck1", str(resp.data))
+            self.assertEqual(len(statements), 2)
+
+            # map data comes from the database, never from MapBox
+            mock_client.get_json.assert_not_called()
+
+    def test_trucks_nearby(self):
+        self.truck1.latitude, self.truck1.longitude = 41.552586, -90.50243     # Bettendorf
+        self.truck2.latitude, self.truck2.longitude = 41.523644, -90.577637    # Davenport
+        self.truck3.latitude, self.truck3.longitude = 41.878114, -87.629798    # Chicago
+        self.setup_trucks()
+
+        with self.client as c:
+            resp = c.get("/trucks/nearby", query_string={"lat": 41.5236, "lng": -90.5776, "radius": 10})
+
+            self.assertEqual(resp.status_code, 200)
+
+            trucks = resp.json["trucks"]
+            self.assertEqual([truck["name"] for truck in trucks], ["Testing Truck2", "Testing Truck1"])
+            self.assertLess(trucks[0]["distance"], trucks[1]["distance"])
+
+    def test_trucks_nearby_antimeridian(self):
+        """Are trucks just across ±180 longitude found?"""
+
+        self.truck1.latitude, self.truck1.longitude = 0.0, -179.95
+        self.truck2.latitude, self.truck2.longitude = 0.0, 179.9
+        self.truck3.latitude, self.truck3.longitude = 0.0, 170.0
+        self.setup_trucks()
+
+        with self.client as c:
+            resp = c.get("/trucks/nearby", query_string={"lat": 0, "lng": 179.95, "radius": 20})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([truck["name"] for truck in resp.json["trucks"]], ["Testing Truck2", "Testing Truck1"])
+
+    def test_trucks_nearby_invalid(self):
+        with self.client as c:
+            self.assertEqual(c.get("/trucks/nearby").status_code, 400)
+            self.assertEqual(c.get("/trucks/nearby", query_string={"lat": "abc", "lng": 1}).status_code, 400)
+            self.assertEqual(c.get("/trucks/nearby", query_string={"lat": 95, "lng": 1}).status_code, 400)
+
+    def test_trucks_geojson(self):
+        self.truck1.latitude, self.truck1.longitude = 41.552586, -90.50243     # Bettendorf
+        self.truck3.latitude, self.truck3.longitude = 41.878114, -87.629798    # Chicago
+        self.setup_trucks()
+
+        with self.client as c:
+            resp = c.get("/api/trucks.geojson", query_string={"bbox": "-91,41,-90,42"})
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json["type"], "FeatureCollection")
+
+            features = resp.json["features"]
+            self.assertEqual(len(features), 1)
+            self.assertEqual(features[0]["properties"]["name"], "Testing Truck1")
+            self.assertEqual(features[0]["geometry"]["coordinates"], [-90.50243, 41.552586])
+
+            self.assertEqual(c.get("/api/trucks.geojson", query_string={"bbox": "bad"}).status_code, 400)
+
+    def test_trucks_geojson_conditional(self):
+        self.truck1.latitude, self.truck1.longitude = 41.552586, -90.50243
+        self.setup_trucks()
+
+        with self.client as c:
+            resp = c.get("/api/trucks.geojson")
+            etag = resp.headers["ETag"]
+
+            resp = c.get("/api/trucks.geojson", headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.data, b"")
+
+    def test_trucks_geojson_clustered(self):
+        self.truck1.latitude, self.truck1.longitude = 41.552586, -90.50243     # Bettendorf
+        self.truck2.latitude, self.truck2.longitude = 41.523644, -90.577637    # Davenport
+        self.truck3.latitude, self.truck3.longitude = 41.878114, -87.629798    # Chicago
+        self.setup_trucks()
+        clustering.index.invalidate()
+
+        with self.client as c:
+            resp = c.get("/api/trucks.geojson", query_string={"zoom": 7})
+            counts = sorted(feature["properties"].get("point_count", 1) for feature in resp.json["features"])
+            self.assertEqual(counts, [1, 2])
+
+            resp = c.get("/api/trucks.geojson", query_string={"zoom": 16, "bbox": "-91,41,-90,42"})
+            names = sorted(feature["properties"]["name"] for feature in resp.json["features"])
+            self.assertEqual(names, ["Testing Truck1", "Testing Truck2"])
+
+    def test_metrics_requires_token(self):
+        with self.client as c:
+            self.assertEqual(c.get("/api/metrics").status_code, 404)
+
+            with patch.dict(app.config, METRICS_TOKEN="s3cret"):
+                self.assertEqual(c.get("/api/metrics").status_code, 401)
+                resp = c.get("/api/metrics", headers={"Authorization": "Bearer wrong"})
+                self.assertEqual(resp.status_code, 401)
+
+    def test_trucks_geojson_bad_zoom(self):
+        with self.client as c:
+            for zoom in ("nan", "inf"):
+                resp = c.get("/api/trucks.geojson", query_string={"zoom": zoom})
+                self.assertEqual(resp.status_code, 400)
+
+            # out-of-range zooms are clamped
+            resp = c.get("/api/trucks.geojson", query_string={"zoom": -3})
+            self.assertEqual(resp.status_code, 200)
+            resp = c.get("/api/trucks.geojson", query_string={"zoom": 1e300})
+            self.assertEqual(resp.status_code, 200)
+
     def test_truck_show(self):
 
         t = self.truck1
@@ -338,6 +591,212 @@ class TruckViewTestCase(TestCase):
 
             self.assertEqual(resp.status_code, 404)
 
+    def test_db_pool_exhausted(self):
+        """Is a request that can't get a database connection shed with 503?"""
+
+        db.session.commit()             # return the test's connection to the pool
+
+        with self.client as c:
+            with patch("dbpool.MeteredQueuePool._do_get", side_effect=exc.TimeoutError("pool exhausted")):
+                resp = c.get("/trucks")
+
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp.headers["Retry-After"], "1")
+
+    def test_truck_show_query_count(self):
+        """Truck page: version check, then truck, rating and latest reviews with authors in one query."""
+
+        self.setup_reviews()
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get("/trucks")            # caches the logged-in identity
+
+            with count_queries() as statements:
+                resp = c.get(f"/trucks/{self.truck1_id}")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(len(statements), 2)
+
+            html = str(resp.data)
+            self.assertIn("3.5 / 5", html)
+            self.assertLess(html.index("Author: Testub2 Testingub2"), html.index("Author: Test1 Testing1"))
+            self.assertNotIn("TERRIBLE", html)
+
+    def test_truck_show_conditional_get(self):
+        """Is an unchanged truck page answered 304 from one query, and re-rendered after a change?"""
+
+        self.setup_reviews()
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.get(f"/trucks/{self.truck1_id}")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertTrue(resp.cache_control.public)
+            self.assertIn("Cookie", resp.vary)
+            self.assertIsNone(resp.last_modified)      # one-second resolution: ETag only
+            etag, weak = resp.get_etag()
+            self.assertFalse(weak)
+
+            with count_queries() as statements:
+                resp = c.get(f"/trucks/{self.truck1_id}", headers={"If-None-Match": f'"{etag}"'})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(len(statements), 1)
+
+            truck = db.session.get(Truck, self.truck1_id)
+            truck.bio = "Now with churros."
+            db.session.commit()
+
+            resp = c.get(f"/trucks/{self.truck1_id}", headers={"If-None-Match": f'"{etag}"'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Now with churros.", str(resp.data))
+
+    def test_truck_pages_conditional_get_author_rename(self):
+        """Does a reviewer's name change invalidate the truck page and review list ETags?"""
+
+        self.setup_reviews()
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            urls = (f"/trucks/{self.truck1_id}", f"/trucks/{self.truck1_id}/reviews")
+            etags = {url: c.get(url).get_etag()[0] for url in urls}
+
+            author = db.session.get(Review, self.review3_id).users
+            author.first_name = "Renamed"
+            db.session.commit()
+
+            for url in urls:
+                resp = c.get(url, headers={"If-None-Match": f'"{etags[url]}"'})
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn(f"Author: Renamed {author.last_name}", str(resp.data))
+
+    def test_trucks_conditional_get(self):
+        """Is the truck list revalidated from one row, and changed by every truck write, deletes included?"""
+
+        self.setup_trucks()
+        db.session.commit()
+
+        with self.client as c:
+            etag = c.get("/trucks").get_etag()[0]
+
+            with count_queries() as statements:
+                resp = c.get("/trucks", headers={"If-None-Match": f'"{etag}"'})
+
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(len(statements), 1)
+            self.assertIn("table_versions", statements[0])
+
+            # a review only moves rating aggregates, which the list doesn't show
+            db.session.add(Review(user_id=self.u1_id, truck_id=self.truck1_id, rating=4.0, review="Tasty."))
+            db.session.commit()
+
+            resp = c.get("/trucks", headers={"If-None-Match": f'"{etag}"'})
+            self.assertEqual(resp.status_code, 304)
+
+            # two writes in the same second each give a new ETag
+            for bio in ("Now with churros.", "Now with tamales."):
+                db.session.get(Truck, self.truck1_id).bio = bio
+                db.session.commit()
+
+                resp = c.get("/trucks", headers={"If-None-Match": f'"{etag}"'})
+                self.assertEqual(resp.status_code, 200)
+                etag = resp.get_etag()[0]
+
+            db.session.delete(db.session.get(Truck, self.truck2_id))
+            db.session.commit()
+
+            resp = c.get("/trucks", headers={"If-None-Match": f'"{etag}"'})
+            self.assertEqual(resp.status_code, 200)
+
+    def test_conditional_get_per_user(self):
+        """Logged-in pages are private, and favoriting changes the ETag (the star)."""
+
+        db.session.add(self.truck1)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get("/trucks")
+            etag = resp.get_etag()[0]
+
+            self.assertTrue(resp.cache_control.private)
+            self.assertTrue(resp.cache_control.no_cache)
+            self.assertIsNone(resp.last_modified)
+
+            resp = c.get("/trucks", headers={"If-None-Match": f'"{etag}"'})
+            self.assertEqual(resp.status_code, 304)
+
+            c.post(f"/trucks/{self.truck1_id}/favorite")
+
+            # the favorite's flash message is shown: no validators on that render
+            resp = c.get("/trucks", headers={"If-None-Match": f'"{etag}"'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIsNone(resp.get_etag()[0])
+
+            resp = c.get("/trucks", headers={"If-None-Match": f'"{etag}"'})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotEqual(resp.get_etag()[0], etag)
+
+    def test_truck_show_fragment_cache_author_rename(self):
+        """Does a reviewer's profile edit show on truck pages without the truck changing?"""
+
+        self.setup_reviews()
+        db.session.commit()
+
+        with self.client as c:
+            c.get(f"/trucks/{self.truck1_id}")
+
+            author = db.session.get(Review, self.review3_id).users
+            old_name = author.full_name
+            author.first_name = "Renamed"
+            db.session.commit()
+
+            resp = c.get(f"/trucks/{self.truck1_id}")
+            self.assertIn(f"Author: Renamed {author.last_name}", str(resp.data))
+            self.assertNotIn(f"Author: {old_name}<", str(resp.data))
+
+    def test_truck_show_fragment_cache(self):
+        """Is the truck page body reused until the truck or its reviews change?"""
+
+        self.setup_reviews()
+        db.session.commit()
+
+        with self.client as c:
+            c.get(f"/trucks/{self.truck1_id}")
+            hits = fragments.cache.stats()["hits"]
+
+            resp = c.get(f"/trucks/{self.truck1_id}")
+            self.assertEqual(fragments.cache.stats()["hits"], hits + 3)
+            self.assertIn("This is an OK test truck review!", str(resp.data))
+
+            version = db.session.get(Truck, self.truck1_id).updated_at
+
+            review = db.session.get(Review, self.review3_id)
+            review.review = "Edited: better than OK."
+            db.session.commit()
+
+            # a text-only edit still bumps the truck's version (other workers' caches)
+            self.assertGreater(db.session.get(Truck, self.truck1_id).updated_at, version)
+
+            resp = c.get(f"/trucks/{self.truck1_id}")
+            self.assertIn("Edited: better than OK.", str(resp.data))
+            self.assertNotIn("This is an OK test truck review!", str(resp.data))
+
+            with patch.dict(app.config, METRICS_TOKEN="s3cret"):
+                resp = c.get("/api/metrics", headers={"Authorization": "Bearer s3cret"})
+            self.assertIn("fragment_cache", resp.json)
+            self.assertGreater(resp.json["db_pool"]["checkouts"], 0)
+
     def setup_reviews(self):
         truck1 = self.truck1
         truck2 = self.truck2
@@ -405,8 +864,8 @@ class TruckViewTestCase(TestCase):
             resp = c.post(f'/trucks/{truck.id}/location', follow_redirects=True)
 
             self.assertEqual(resp.status_code, 200)
-            self.assertEqual(truck.latitude, "41.552586")
-            self.assertEqual(truck.longitude, "-90.50243")
+            self.assertEqual(truck.latitude, 41.552586)
+            self.assertEqual(truck.longitude, -90.50243)
             self.assertIn("Location successfully updated!", str(resp.data))
             self.assertIn("2900 Learning Campus Dr, Bettendorf, IA 52722", str(resp.data))
 
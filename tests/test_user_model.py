@@ -6,9 +6,11 @@
 
 import os
 from unittest import TestCase
+from unittest.mock import patch
 from sqlalchemy import exc
 
-from models import db, User
+from models import db, bcrypt, User
+import passwords
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -21,6 +23,9 @@ os.environ['DATABASE_URL'] = "postgresql:///food_truck_test"
 
 from app import app
 
+# one app context for the whole module (the app doesn't push one itself)
+app.app_context().push()
+
 
 class UserModelTestCase(TestCase):
     """Test User model."""
@@ -217,9 +222,45 @@ class UserModelTestCase(TestCase):
     def test_invalid_username(self):
         self.assertFalse(User.authenticate("badusername", "password"))
 
+    def test_invalid_username_costs_a_bcrypt_check(self):
+        """Unknown usernames still run a full-cost check, so timing doesn't reveal them."""
+
+        with patch.object(passwords.pool, "run", wraps=passwords.pool.run) as run:
+            self.assertFalse(User.authenticate("badusername", "password"))
+
+        (fn, pw_hash, password), kwargs = run.call_args
+        self.assertEqual(passwords.cost(pw_hash), app.config['BCRYPT_LOG_ROUNDS'])
+
     def test_wrong_password(self):
         self.assertFalse(User.authenticate(self.u1.username, "badpassword"))
 
+    def test_rehash_on_login(self):
+        """Is a hash made with an old cost factor upgraded when the user logs in?"""
+
+        self.u1.password = bcrypt.generate_password_hash("password", rounds=4).decode('UTF-8')
+        db.session.commit()
+
+        u = User.authenticate(self.u1.username, "password")
+        self.assertEqual(passwords.cost(u.password), app.config['BCRYPT_LOG_ROUNDS'])
+        self.assertTrue(u.check_password("password"))
+
+        # a wrong password never rewrites the hash
+        old_hash = u.password
+        self.assertFalse(u.check_password("badpassword"))
+        self.assertEqual(u.password, old_hash)
+
+    def test_hash_uses_app_rounds(self):
+        """Are new hashes made at BCRYPT_LOG_ROUNDS even if Flask-Bcrypt was set up with other rounds?"""
+
+        with patch.dict(app.config, BCRYPT_LOG_ROUNDS=5), patch.object(bcrypt, "_log_rounds", 6):
+            pw_hash = User.hash_password("password")
+            self.assertEqual(passwords.cost(pw_hash), 5)
+
+            self.u1.password = pw_hash
+            with patch.object(User, "set_password") as set_password:
+                self.assertTrue(self.u1.check_password("password"))
+            set_password.assert_not_called()
+
 
   
 
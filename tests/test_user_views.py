@@ -6,8 +6,13 @@
 
 import os
 from unittest import TestCase
+from unittest.mock import patch
 
 from models import db, Truck, User, Favorite, Review
+import identity
+import fragments
+import passwords
+import throttle
 from bs4 import BeautifulSoup
 
 # BEFORE we import our app, let's set an environmental variable
@@ -19,7 +24,12 @@ os.environ['DATABASE_URL'] = "postgresql:///food_truck_test"
 
 # Now we can import app
 
-from app import app, CURR_USER_KEY
+from flask import render_template_string, g
+
+from app import app, CURR_USER_KEY, LazyLoadError
+
+# one app context for the whole module (the app doesn't push one itself)
+app.app_context().push()
 
 # Create our tables (we do this here, so we only create the tables
 # once for all tests --- in each test, we'll delete the data
@@ -31,6 +41,10 @@ db.create_all()
 # Don't have WTForms use CSRF at all, since it's a pain to test
 
 app.config['WTF_CSRF_ENABLED'] = False
+
+# Fail any view whose template lazy-loads a relationship (N+1 queries)
+
+app.config['RAISE_ON_LAZY_LOAD'] = True
 app.testing = True
 
 class UserViewTestCase(TestCase):
@@ -41,6 +55,9 @@ class UserViewTestCase(TestCase):
 
         User.query.delete()
         Truck.query.delete()
+        identity.cache.clear()
+        fragments.cache.clear()
+        throttle.throttle.clear()
 
         self.client = app.test_client()
 
@@ -181,6 +198,91 @@ class UserViewTestCase(TestCase):
             self.assertIn("Favorites:", str(resp.data))
 
 
+    def test_login(self):
+        with self.client as c:
+            resp = c.post("/login", data={"username": "testub1", "password": "password"})
+
+            self.assertEqual(resp.status_code, 302)
+            self.assertEqual(c.get("/").status_code, 200)
+
+    def test_login_shed_when_password_pool_full(self):
+        """Logins beyond the password pool's queue get a fast 503."""
+
+        with patch.object(passwords.pool, "run", side_effect=passwords.PasswordPoolBusy):
+            resp = self.client.post("/login", data={"username": "testub1", "password": "password"})
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers["Retry-After"], "1")
+
+    def test_login_throttled(self):
+        """Repeated failed logins for one username are refused before bcrypt runs."""
+
+        with self.client as c:
+            for i in range(throttle.throttle.per_user.limit):
+                resp = c.post("/login", data={"username": "testub1", "password": "wrongpassword"})
+                self.assertEqual(resp.status_code, 200)
+
+            with patch.object(passwords.pool, "run") as run:
+                resp = c.post("/login", data={"username": "testub1", "password": "password"})
+                run.assert_not_called()
+
+            self.assertEqual(resp.status_code, 429)
+            self.assertGreater(int(resp.headers["Retry-After"]), 0)
+            self.assertIn("Too many login attempts", str(resp.data))
+
+    def test_login_throttled_per_client_behind_proxy(self):
+        """Is the per-address limit per client, not per proxy, when requests come through a proxy?"""
+
+        throttle.configure_throttle(per_ip=2)
+        self.addCleanup(throttle.configure_throttle)
+
+        with self.client as c:
+            for username in ("baduser1", "baduser2"):
+                resp = c.post("/login", data={"username": username, "password": "wrongpassword"},
+                              headers={"X-Forwarded-For": "203.0.113.1"})
+                self.assertEqual(resp.status_code, 200)
+
+            resp = c.post("/login", data={"username": "baduser3", "password": "wrongpassword"},
+                          headers={"X-Forwarded-For": "203.0.113.1"})
+            self.assertEqual(resp.status_code, 429)
+
+            # another client through the same proxy address isn't locked out
+            resp = c.post("/login", data={"username": "testub1", "password": "password"},
+                          headers={"X-Forwarded-For": "203.0.113.2"})
+            self.assertEqual(resp.status_code, 302)
+
+    def test_identity_cached(self):
+        """Is the logged-in user's identity reused instead of reloaded every request?"""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            c.get("/")
+
+            with patch("identity.Identity.load") as load:
+                resp = c.get(f"/users/{self.testuser_id}")
+                load.assert_not_called()
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Test Testing", str(resp.data))
+
+    def test_identity_invalidated_on_favorite(self):
+        """Does favoriting a truck refresh the user's cached favorite ids?"""
+
+        db.session.add(self.truck1)
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.get("/")
+            self.assertEqual(identity.cache.get(self.u1_id).favorite_ids, frozenset())
+
+            c.post(f"/trucks/{self.truck1_id}/favorite")
+            self.assertEqual(identity.cache.get(self.u1_id).favorite_ids, {self.truck1_id})
+
     def test_add_favorite(self):
 
         db.session.add(self.truck1)
@@ -261,6 +363,34 @@ class UserViewTestCase(TestCase):
             # The number of favorites has not changed since making the request
             self.assertEqual(favorite_count, Favorite.query.count())
     
+    def test_api_toggle_favorite(self):
+        """Does the JSON endpoint toggle the favorite and report the new state?"""
+
+        db.session.add(self.truck1)
+        db.session.commit()
+
+        with self.client as c:
+            resp = c.post(f"/api/trucks/{self.truck1_id}/favorite")
+            self.assertEqual(resp.status_code, 401)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.post(f"/api/trucks/{self.truck1_id}/favorite")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.json, {"truck_id": self.truck1_id, "favorited": True})
+            self.assertEqual(Favorite.query.filter_by(user_id=self.u1_id).count(), 1)
+
+            resp = c.post(f"/api/trucks/{self.truck1_id}/favorite")
+            self.assertEqual(resp.json, {"truck_id": self.truck1_id, "favorited": False})
+            self.assertEqual(Favorite.query.filter_by(user_id=self.u1_id).count(), 0)
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ub1_id
+
+            resp = c.post(f"/api/trucks/{self.truck1_id}/favorite")
+            self.assertEqual(resp.status_code, 403)
+
     def setup_reviews(self):
         truck1 = self.truck1
         truck2 = self.truck2
@@ -307,6 +437,49 @@ class UserViewTestCase(TestCase):
             # test for header to indicate we are on the Favorites tab:
             self.assertIn("Reviews:", str(resp.data))
 
+    def test_lazy_load_guard(self):
+        """Does rendering a relationship the view didn't load raise?"""
+
+        self.setup_reviews()
+        db.session.expire_all()
+
+        with app.test_request_context():
+            user = db.session.get(User, self.testuser_id)
+
+            # loaded before rendering: fine
+            self.assertEqual(render_template_string("{{ reviews | length }}", reviews=user.reviews), "2")
+
+            db.session.expire(user)
+
+            with self.assertRaises(LazyLoadError):
+                render_template_string("{{ user.reviews | length }}", user=user)
+
+    def test_profile_badge_counts(self):
+        """Are the header's review/favorite counts COUNT queries, not loaded collections?"""
+
+        self.setup_reviews()
+        self.setup_favorites()
+        db.session.expire_all()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.testuser_id
+
+            resp = c.get(f"/users/{self.testuser_id}")
+
+            self.assertEqual(resp.status_code, 200)
+
+            soup = BeautifulSoup(resp.data, 'html.parser')
+            counts = [h4.get_text(strip=True) for h4 in soup.select(".user-stats .stat h4")]
+            self.assertEqual(counts, ["2", "2"])
+
+            # the two most recent favorites, and no collections were loaded for the badges
+            self.assertEqual(len(soup.find_all("li", {"class": "list-group-item"})), 2)
+
+            user = g.user.user
+            self.assertNotIn("reviews", user.__dict__)
+            self.assertNotIn("favorites", user.__dict__)
+
     def test_users_delete_review(self):
         self.setup_reviews()
 
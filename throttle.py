@@ -0,0 +1,190 @@
+"""Login attempt throttling: per-username and per-client-address limits, in process or in a table."""
+
+import threading
+import time
+from collections import OrderedDict, deque
+
+from sqlalchemy import MetaData, Table, Column, Text, Float, Index, create_engine, select, delete, func
+
+DEFAULT_PER_USER = 5
+DEFAULT_PER_IP = 20
+DEFAULT_WINDOW = 300
+
+
+class MemoryRateLimiter:
+    """At most `limit` hits per key in any `window` seconds, tracked in process."""
+
+    def __init__(self, limit, window=DEFAULT_WINDOW, maxkeys=10000, clock=time.monotonic):
+        self.limit = limit
+        self.window = window
+        self.maxkeys = maxkeys
+        self.clock = clock
+        self.allowed = 0
+        self.rejected = 0
+        self._hits = OrderedDict()          # key -> deque of hit times, least recently hit first
+        self._lock = threading.Lock()
+
+    def hit(self, key):
+        """Record a hit for key.  Return 0 if allowed, else seconds until one would be."""
+
+        now = self.clock()
+
+        with self._lock:
+            hits = self._hits.get(key)
+
+            if hits is None:
+                hits = self._hits[key] = deque()
+                while len(self._hits) > self.maxkeys:
+                    self._hits.popitem(last=False)
+
+            while hits and hits[0] <= now - self.window:
+                hits.popleft()
+
+            if len(hits) >= self.limit:
+                self.rejected += 1
+                return hits[0] + self.window - now
+
+            hits.append(now)
+            self._hits.move_to_end(key)
+            self.allowed += 1
+            return 0
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._hits.clear()
+
+    def stats(self):
+        return {"backend": "memory", "limit": self.limit, "window": self.window, "keys": len(self._hits),
+                "allowed": self.allowed, "rejected": self.rejected}
+
+
+class DatabaseRateLimiter:
+    """At most `limit` hits per key in any `window` seconds, tracked in a SQL table (own engine)."""
+
+    metadata = MetaData()
+
+    table = Table("login_attempts", metadata,
+                  Column("key", Text, nullable=False),
+                  Column("at", Float, nullable=False),
+                  Index("ix_login_attempts_key_at", "key", "at"),
+                  Index("ix_login_attempts_at", "at"))
+
+    def __init__(self, url_or_engine, limit, window=DEFAULT_WINDOW, clock=time.time, purge_interval=60):
+        if isinstance(url_or_engine, str):
+            url_or_engine = create_engine(url_or_engine)
+
+        self.engine = url_or_engine
+        self.limit = limit
+        self.window = window
+        self.clock = clock
+        self.allowed = 0
+        self.rejected = 0
+        self.purge_interval = purge_interval
+        self._purged_at = None
+        self._table_ready = False
+        self._table_lock = threading.Lock()
+
+    def _ensure_table(self):
+        """Create the table on first use (not at startup)."""
+
+        if not self._table_ready:
+            with self._table_lock:
+                if not self._table_ready:
+                    self.metadata.create_all(self.engine)
+                    # create_all skips indexes of a table that already exists
+                    for index in self.table.indexes:
+                        index.create(self.engine, checkfirst=True)
+                    self._table_ready = True
+
+    def hit(self, key):
+        """Record a hit for key.  Return 0 if allowed, else seconds until one would be."""
+
+        now = self.clock()
+        t = self.table
+        self._ensure_table()
+
+        with self.engine.begin() as conn:
+            # expired rows of every key, not just this one: keys that are never hit again
+            if self._purged_at is None or now - self._purged_at >= self.purge_interval:
+                conn.execute(delete(t).where(t.c.at <= now - self.window))
+                self._purged_at = now
+
+            count, oldest = conn.execute(select(func.count(), func.min(t.c.at))
+                                         .where(t.c.key == key, t.c.at > now - self.window)).one()
+
+            # count-then-insert isn't atomic: concurrent attempts from several
+            # workers may each see room and overshoot the limit by a few
+            if count >= self.limit:
+                self.rejected += 1
+                return oldest + self.window - now
+
+            conn.execute(t.insert().values(key=key, at=now))
+
+        self.allowed += 1
+        return 0
+
+    def reset(self, key):
+        self._ensure_table()
+
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table).where(self.table.c.key == key))
+
+    def clear(self):
+        self._ensure_table()
+
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table))
+
+    def stats(self):
+        return {"backend": "database", "limit": self.limit, "window": self.window, "allowed": self.allowed, "rejected": self.rejected}
+
+
+class LoginThrottle:
+    """Per-username and per-client-address login attempt limits."""
+
+    def __init__(self, per_user, per_ip):
+        self.per_user = per_user
+        self.per_ip = per_ip
+
+    @staticmethod
+    def user_key(username):
+        return f"user:{(username or '').strip().lower()}"
+
+    def attempt(self, username, ip):
+        """Record a login attempt.  Return 0 if it may proceed, else seconds to wait."""
+
+        return self.per_ip.hit(f"ip:{ip}") or self.per_user.hit(self.user_key(username))
+
+    def succeeded(self, username):
+        """Clear the username's attempts after a successful login."""
+
+        self.per_user.reset(self.user_key(username))
+
+    def clear(self):
+        self.per_user.clear()
+        self.per_ip.clear()
+
+    def stats(self):
+        return {"per_user": self.per_user.stats(), "per_ip": self.per_ip.stats()}
+
+
+throttle = LoginThrottle(MemoryRateLimiter(DEFAULT_PER_USER), MemoryRateLimiter(DEFAULT_PER_IP))
+
+
+def configure_throttle(per_user=DEFAULT_PER_USER, per_ip=DEFAULT_PER_IP, window=DEFAULT_WINDOW, database_url=None):
+    """Replace the module throttle: in-process limits, or limits shared through a table at `database_url`."""
+
+    global throttle
+
+    if database_url:
+        engine = create_engine(database_url)
+        throttle = LoginThrottle(DatabaseRateLimiter(engine, per_user, window),
+                                 DatabaseRateLimiter(engine, per_ip, window))
+    else:
+        throttle = LoginThrottle(MemoryRateLimiter(per_user, window), MemoryRateLimiter(per_ip, window))
+
+    return throttle